@@ -0,0 +1,85 @@
+'''Audit trail
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the audit trail of the application. Every action
+    of the users is queued in memory and a background thread writes the queued
+    events to the logs table in batches, when there are enough of them or when
+    the oldest one has waited long enough, so the form never waits for a commit.
+    The pending events are written when the audit trail is closed.
+Date: 2023-06-30
+'''
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("auditoria")
+
+# Number of events written on each transaction
+TAM_LOTE = 100
+
+# Maximum seconds an event waits in memory before being written
+INTERVALO = 2.0
+
+# Event put on the queue to stop the writer thread
+_FIN = object()
+
+
+class Auditoria:
+    '''Buffered writer of the events of the audit trail to the logs table'''
+    def __init__(self, database, tam_lote=TAM_LOTE, intervalo=INTERVALO):
+        '''Constructor. Starts the writer thread'''
+        self.database = database
+        self.tam_lote = tam_lote
+        self.intervalo = intervalo
+        self.cola = queue.Queue()
+        self._hilo = threading.Thread(target=self._escribir, name="auditoria", daemon=True)
+        self._hilo.start()
+
+    def registrar(self, usuario, accion):
+        '''Queue an event, with the time at which it happens. Never blocks'''
+        fecha = datetime.now().isoformat(sep=" ", timespec="milliseconds")
+        self.cola.put((fecha, usuario, accion))
+
+    def cerrar(self):
+        '''Write the pending events and stop the writer thread'''
+        if self._hilo.is_alive():
+            self.cola.put(_FIN)
+            self._hilo.join()
+
+    def _escribir(self):
+        '''Writer thread: collect the queued events and write them by size or time'''
+        pendientes = []
+        limite = None
+        while True:
+            espera = None if not pendientes else max(0.0, limite - time.monotonic())
+            try:
+                evento = self.cola.get(timeout=espera)
+            except queue.Empty:
+                evento = None
+            if evento is _FIN:
+                self._volcar(pendientes)
+                return
+            if evento is not None:
+                if not pendientes:
+                    limite = time.monotonic() + self.intervalo
+                pendientes.append(evento)
+            if len(pendientes) >= self.tam_lote or (pendientes and time.monotonic() >= limite):
+                # If the batch can't be written, it's tried again after another interval
+                if not self._volcar(pendientes):
+                    limite = time.monotonic() + self.intervalo
+
+    def _volcar(self, pendientes):
+        '''Write the pending events in a single transaction. Returns whether they were written'''
+        if not pendientes:
+            return True
+        try:
+            self.database.insert_logs(pendientes)
+        except sqlite3.Error as error:
+            logger.error("No se han podido guardar %d eventos: %s", len(pendientes), error)
+            return False
+        pendientes.clear()
+        return True
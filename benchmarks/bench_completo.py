@@ -0,0 +1,250 @@
+'''Benchmark suite
+
+Author: Alejandro Sanchez Rodriguez
+Description: Measures the main operations of Database and Excel on synthetic
+    registers at several sizes: form inserts, bulk insert, lookups by identificador,
+    date range queries, export, import and formato_hoja. Each operation runs in
+    its own process, so its peak memory is its own, and the results are saved to
+    a JSON file that can be compared with the one of a previous run. Runs
+    headless, without creating any Tk window.
+Date: 2023-06-30
+
+Usage: python benchmarks/bench_completo.py [--tamanos 10000,100000,1000000]
+    [--salida resultados.json] [--comparar anterior.json]
+'''
+
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.dirname(__file__))
+import db
+import datos
+
+TAMANOS = [10000, 100000, 1000000]
+
+# Number of form inserts and of lookups measured at every size
+OPERACIONES_UNITARIAS = 1000
+
+# Maximum rows loaded in a normal workbook to measure formato_hoja, which keeps
+# every cell in memory
+MAX_FILAS_FORMATO = 100000
+
+
+def configuracion():
+    '''Pragmas and headers configured in config.ini'''
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), os.pardir, "config.ini"))
+    pragmas = {clave: valor for clave, valor in config["DB"].items() if clave in db.PRAGMAS}
+    cabeceras = [cabecera.strip() for cabecera in config["DATA"]["DATA_HEADERS"].split(",")]
+    return pragmas, cabeceras
+
+def memoria_pico():
+    '''Peak resident memory of the current process in MB, where it can be read'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def base_de_datos(archivo):
+    '''Open a benchmark database with the pragmas of config.ini'''
+    pragmas, _ = configuracion()
+    database = db.Database(archivo, pragmas)
+    database.migrate()
+    return database
+
+def copia(base, directorio):
+    '''Copy of a benchmark database, so an operation doesn't change it for the next ones'''
+    destino = os.path.join(directorio, "copia.db")
+    origen = sqlite3.connect(base)
+    conexion = sqlite3.connect(destino)
+    origen.backup(conexion)
+    conexion.close()
+    origen.close()
+    return destino
+
+
+################################################################################
+# Operations. Each one receives the base database with n registers and a working
+# directory, and returns the number of rows it processed and the seconds it took
+
+def insercion_masiva(base, directorio, n):
+    '''Bulk insert of n registers in a new database, which becomes the base one'''
+    database = base_de_datos(base)
+    registros = list(datos.generar_registros(n))
+    inicio = time.perf_counter()
+    database.insert_multiples_registros(registros)
+    segundos = time.perf_counter() - inicio
+    database.close()
+    return n, segundos
+
+def insercion(base, directorio, n):
+    '''Form inserts, one upsert and one commit each'''
+    database = base_de_datos(copia(base, directorio))
+    registros = list(datos.generar_registros(OPERACIONES_UNITARIAS, semilla=1))
+    for registro in registros:
+        registro[2] = "N" + registro[2]
+    inicio = time.perf_counter()
+    for registro in registros:
+        database.upsert_registro(registro)
+    segundos = time.perf_counter() - inicio
+    database.close()
+    return len(registros), segundos
+
+def busqueda(base, directorio, n):
+    '''Lookups of random registers by identificador'''
+    database = base_de_datos(base)
+    aleatorio = random.Random(0)
+    identificadores = [f"ID{aleatorio.randrange(n):09d}" for _ in range(OPERACIONES_UNITARIAS)]
+    inicio = time.perf_counter()
+    for identificador in identificadores:
+        database.get_registro_by("identificador", identificador)
+    segundos = time.perf_counter() - inicio
+    database.close()
+    return len(identificadores), segundos
+
+def rango_fechas(base, directorio, n):
+    '''Read the registers of a month'''
+    database = base_de_datos(base)
+    inicio = time.perf_counter()
+    filas = sum(1 for _ in database.iter_registros("01-03-2023", "31-03-2023"))
+    segundos = time.perf_counter() - inicio
+    database.close()
+    return filas, segundos
+
+def exportacion(base, directorio, n):
+    '''Export every register to Excel, as the application does'''
+    import exportador
+    _, cabeceras = configuracion()
+    database = base_de_datos(base)
+    inicio = time.perf_counter()
+    filas = exportador.exportar_registros(database, os.path.join(directorio, "exportacion.xlsx"),
+                                          cabeceras)
+    segundos = time.perf_counter() - inicio
+    database.close()
+    return filas, segundos
+
+def importacion(base, directorio, n):
+    '''Validate and import an Excel file with n registers in a new database'''
+    import importador
+    import validacion
+    _, cabeceras = configuracion()
+    archivo = os.path.join(directorio, os.pardir, f"importacion_{n}.xlsx")
+    database = base_de_datos(os.path.join(directorio, "importacion.db"))
+    inicio = time.perf_counter()
+    filas = importador.importar_registros(database, archivo, cabeceras[1:],
+                                          validacion.validar_registros).filas
+    segundos = time.perf_counter() - inicio
+    database.close()
+    return filas, segundos
+
+def formato_hoja(base, directorio, n):
+    '''Apply the styles to a normal workbook with up to MAX_FILAS_FORMATO registers'''
+    from excel import Excel
+    _, cabeceras = configuracion()
+    database = base_de_datos(base)
+    filas = min(n, MAX_FILAS_FORMATO)
+    excel = Excel()
+    excel.crear_archivo(os.path.join(directorio, "formato.xlsx"))
+    excel.rellenar_cabeceras(cabeceras)
+    registros = database.iter_registros()
+    for registro in islice(registros, filas):
+        excel.hoja.append(registro)
+    registros.close()
+    database.close()
+    inicio = time.perf_counter()
+    excel.formato_cabecera()
+    excel.formato_hoja()
+    segundos = time.perf_counter() - inicio
+    return filas, segundos
+
+OPERACIONES = [insercion_masiva, insercion, busqueda, rango_fechas, exportacion, importacion,
+               formato_hoja]
+
+
+################################################################################
+def ejecutar(operacion, base, directorio, n):
+    '''Run an operation in the current process, the child one, and return its result'''
+    filas, segundos = operacion(base, directorio, n)
+    return {
+        "operacion": operacion.__name__,
+        "tamano": n,
+        "filas": filas,
+        "segundos": round(segundos, 4),
+        "filas_por_segundo": round(filas / segundos) if segundos else None,
+        "memoria_pico_mb": memoria_pico(),
+    }
+
+def medir(n, directorio):
+    '''Run every operation on n registers, each one in a new process'''
+    _, cabeceras = configuracion()
+    base = os.path.join(directorio, f"base_{n}.db")
+    datos.generar_libro(os.path.join(directorio, f"importacion_{n}.xlsx"), cabeceras[1:], n)
+    contexto = multiprocessing.get_context("spawn")
+    resultados = []
+    for operacion in OPERACIONES:
+        trabajo = os.path.join(directorio, operacion.__name__)
+        os.makedirs(trabajo)
+        with contexto.Pool(1) as proceso:
+            resultado = proceso.apply(ejecutar, (operacion, base, trabajo, n))
+        shutil.rmtree(trabajo)
+        print(f"{n:>9} {resultado['operacion']:<18} {resultado['segundos']:>10.3f} s "
+              f"{resultado['filas_por_segundo'] or 0:>12} filas/s "
+              f"{resultado['memoria_pico_mb'] or '-':>8} MB", flush=True)
+        resultados.append(resultado)
+    return resultados
+
+def comparar(resultados, anterior):
+    '''Print the change of every operation against the results of a previous run'''
+    with open(anterior, encoding="utf-8") as archivo:
+        previos = {(r["operacion"], r["tamano"]): r for r in json.load(archivo)["resultados"]}
+    print("\nCambio respecto a", anterior)
+    for resultado in resultados:
+        previo = previos.get((resultado["operacion"], resultado["tamano"]))
+        if previo and previo["segundos"]:
+            cambio = resultado["segundos"] / previo["segundos"]
+            print(f"{resultado['tamano']:>9} {resultado['operacion']:<18} {cambio:>8.2f}x tiempo")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de Database y Excel")
+    parser.add_argument("--tamanos", default=",".join(map(str, TAMANOS)),
+                        help="número de registros de cada ejecución, separados por comas")
+    parser.add_argument("--salida", default="resultados_bench.json", help="archivo JSON de resultados")
+    parser.add_argument("--comparar", help="archivo JSON de una ejecución anterior")
+    argumentos = parser.parse_args()
+
+    resultados = []
+    for n in (int(tamano) for tamano in argumentos.tamanos.split(",")):
+        with tempfile.TemporaryDirectory() as directorio:
+            resultados += medir(n, directorio)
+
+    with open(argumentos.salida, "w", encoding="utf-8") as archivo:
+        json.dump({
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "plataforma": platform.platform(),
+            "resultados": resultados,
+        }, archivo, indent=2, ensure_ascii=False)
+    print("Resultados guardados en", argumentos.salida)
+    if argumentos.comparar:
+        comparar(resultados, argumentos.comparar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''Write throughput benchmark
+
+Author: Alejandro Sanchez Rodriguez
+Description: Measures the write throughput of Database with the default SQLite
+    settings and with the pragma profile of config.ini, for form-driven writes
+    (one commit per register), form writes grouped in a transaction, bulk
+    inserts and bulk upserts. Runs headless against temporary databases.
+Date: 2023-06-30
+
+Usage: python benchmarks/bench_escritura.py [registros]
+'''
+
+import configparser
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+import db
+
+REGISTRO = ["01-07-2023", "Operador - op", "123456", 100.5, "OK", "", 0, "", "", "Observaciones"]
+
+
+def registros(n):
+    '''n registers with different identificador, which is unique'''
+    return [REGISTRO[:2] + [str(i)] + REGISTRO[3:] for i in range(n)]
+
+
+def perfil_config():
+    '''Pragmas configured in the [DB] section of config.ini'''
+    config = configparser.ConfigParser()
+    config.read(os.path.join(os.path.dirname(__file__), os.pardir, "config.ini"))
+    return {clave: valor for clave, valor in config["DB"].items() if clave in db.PRAGMAS}
+
+def formulario(database, n):
+    '''One upsert and one commit per register, as the form does'''
+    for registro in registros(n):
+        database.upsert_registro(registro)
+
+def formulario_transaccion(database, n):
+    '''The same upserts, grouped in a single transaction'''
+    with database.transaction():
+        for registro in registros(n):
+            database.upsert_registro(registro)
+
+def carga_masiva(database, n):
+    '''A single bulk insert'''
+    database.insert_multiples_registros(registros(n))
+
+def actualizacion_masiva(database, n):
+    '''A bulk upsert of registers that already exist, as a repeated import does'''
+    database.insert_multiples_registros(registros(n))
+    database.upsert_registros(registros(n))
+
+def medir(pragmas, carga, n):
+    '''Registers per second written by a workload on a new database'''
+    with tempfile.TemporaryDirectory() as directorio:
+        database = db.Database(os.path.join(directorio, "bench.db"), pragmas)
+        database.migrate()
+        inicio = time.perf_counter()
+        carga(database, n)
+        segundos = time.perf_counter() - inicio
+        database.close()
+    return n / segundos
+
+def main(n):
+    perfiles = {"Por defecto": {}, "config.ini": perfil_config()}
+    cargas = [
+        ("Formulario", formulario, min(n, 2000)),
+        ("Formulario (transacción)", formulario_transaccion, n),
+        ("Carga masiva", carga_masiva, n),
+        ("Carga y actualización masiva", actualizacion_masiva, n),
+    ]
+    print(f"{'Carga':<30}" + "".join(f"{perfil:>16}" for perfil in perfiles) + f"{'Mejora':>10}")
+    for nombre, carga, registros in cargas:
+        resultados = [medir(pragmas, carga, registros) for pragmas in perfiles.values()]
+        print(f"{nombre:<30}" + "".join(f"{r:>12.0f} r/s" for r in resultados)
+              + f"{resultados[-1] / resultados[0]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
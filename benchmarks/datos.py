@@ -0,0 +1,57 @@
+'''Synthetic data for the benchmarks
+
+Author: Alejandro Sanchez Rodriguez
+Description: Generates realistic registers, with the same fields, formats and
+    proportions of estados as the ones entered through the form, and Excel files
+    with them ready to be imported. The data depends only on the seed, so two runs
+    of the benchmarks work on exactly the same registers.
+Date: 2023-06-30
+'''
+
+import random
+from datetime import date, timedelta
+from openpyxl import Workbook
+
+OPERADORES = [f"Operador {i} - op{i}" for i in range(1, 21)]
+ESTADOS = ["OK", "KO", "INCIDENCIA"]
+PESOS_ESTADOS = [6, 2, 2]
+PALABRAS = ["cliente", "llamada", "factura", "revisión", "pendiente", "incidencia", "cobro",
+            "devolución", "contrato", "alta", "baja", "reclamación", "urgente", "pago"]
+
+# First day of the registers, which span a year
+INICIO = date(2023, 1, 1)
+
+
+def generar_registros(n, semilla=0):
+    '''Generate n registers as the form writes them: without id, with the dates in
+        the dd-MM-yyyy format and a different identificador each
+    '''
+    aleatorio = random.Random(semilla)
+    for i in range(n):
+        entrada = INICIO + timedelta(days=aleatorio.randrange(365))
+        estado = aleatorio.choices(ESTADOS, PESOS_ESTADOS)[0]
+        incidencia = estado == "INCIDENCIA"
+        resolucion = entrada + timedelta(days=aleatorio.randrange(1, 15)) if incidencia else None
+        yield [
+            entrada.strftime("%d-%m-%Y"),
+            aleatorio.choice(OPERADORES),
+            f"ID{i:09d}",
+            round(aleatorio.uniform(1, 5000), 2),
+            estado,
+            f"Campo {aleatorio.randrange(10)}" if incidencia else "",
+            aleatorio.randrange(1, 10) if incidencia else "",
+            resolucion.strftime("%d-%m-%Y") if incidencia else "",
+            aleatorio.choice(OPERADORES).split(" - ")[0] if incidencia else "",
+            " ".join(aleatorio.choices(PALABRAS, k=aleatorio.randrange(3, 9))),
+        ]
+
+def generar_libro(archivo, cabeceras, n, semilla=0):
+    '''Write an Excel file with n registers and the given headers, as the ones
+        imported by the application
+    '''
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet("Registros")
+    hoja.append(cabeceras)
+    for registro in generar_registros(n, semilla):
+        hoja.append(registro)
+    libro.save(archivo)
@@ -0,0 +1,379 @@
+'''Command-line entry point
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file runs the exports, imports, summary reports and backups
+    without the GUI, so they can be scheduled with cron or any other job runner. It reuses the
+    database, Excel, export and import modules of the application and the same
+    config.ini. Progress and results are written to the standard output as one
+    JSON object per line, and the exit status tells whether the job succeeded.
+Date: 2023-06-30
+
+Usage:
+    python cli.py exportar [--desde dd-MM-yyyy] [--hasta dd-MM-yyyy] [--salida archivo]
+    python cli.py exportar --cambios [--anadir] [--salida archivo]
+    python cli.py exportar --particion mes|operador [--procesos n] [--desde ...] [--hasta ...]
+        [--salida directorio|archivo.zip]
+    python cli.py importar archivo|directorio [archivo ...] [--desde-cero] [--lote n] [--procesos n]
+        [--conservar]
+    python cli.py resumen [--desde dd-MM-yyyy] [--hasta dd-MM-yyyy] [--salida archivo]
+    python cli.py copia [--compactar] [--salida archivo]
+'''
+
+import argparse
+import configparser
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+import db
+import auditoria
+import copias
+
+# Exit status of the jobs. Wrong arguments exit with 2, as usual with argparse
+EXITO = 0
+ERROR = 1
+ERROR_DATOS = 3
+ERROR_ARCHIVO = 4
+ERROR_DB = 5
+CANCELADO = 130
+
+# User written to the audit trail for the jobs run from the command line
+USUARIO = "cli"
+
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini")
+
+
+def emitir(evento, **datos):
+    '''Write an event to the standard output as a line of JSON'''
+    print(json.dumps({"evento": evento, **datos}, ensure_ascii=False, default=str), flush=True)
+
+def fecha(texto):
+    '''Check that an argument is a date in the dd-MM-yyyy format'''
+    try:
+        datetime.strptime(texto, "%d-%m-%Y")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"fecha no válida: {texto} (se espera dd-MM-yyyy)")
+    return texto
+
+def nombre_extraccion(prefijo, desde, hasta):
+    '''Name of an export file, the same one the GUI uses'''
+    if desde and hasta:
+        return f"{prefijo} {desde} - {hasta}.xlsx"
+    if desde:
+        return f"{prefijo} {desde}.xlsx"
+    return f"{prefijo} global.xlsx"
+
+
+################################################################################
+class Aplicacion:
+    '''Database, audit trail and settings of config.ini used by the jobs'''
+    def __init__(self, archivo_config, archivo_db=None):
+        '''Constructor. Opens and migrates the database of config.ini, or archivo_db'''
+        config = configparser.ConfigParser()
+        if not config.read(archivo_config, encoding="utf-8"):
+            raise FileNotFoundError(f"No se encuentra la configuración {archivo_config}")
+        directorio = os.path.dirname(os.path.abspath(archivo_config))
+
+        # Log to the same file as the GUI
+        logging.basicConfig(
+            filename=os.path.join(directorio, config.get("LOG", "FILENAME", fallback="app.log")),
+            level=config.get("LOG", "LEVEL", fallback="INFO"),
+            format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+        pragmas = {clave: valor for clave, valor in config["DB"].items() if clave in db.PRAGMAS}
+        lentas = config.getfloat("DB", "SLOW_QUERY_MS", fallback=None)
+        self.database = db.Database(
+            archivo_db or os.path.join(directorio, config["DB"]["DB_FILENAME"]), pragmas,
+            config.getint("DB", "READERS", fallback=db.LECTORES),
+            None if lentas is None else lentas / 1000)
+        self.database.migrate()
+        self.auditoria = auditoria.Auditoria(self.database)
+        self.cabeceras = [cabecera.strip() for cabecera in config["DATA"]["DATA_HEADERS"].split(",")]
+        self.tam_lote = config.getint("DATA", "IMPORT_BATCH_SIZE", fallback=None)
+        self.copias = os.path.join(directorio, config.get("BACKUP", "DIRECTORY", fallback="copias"))
+        self.conservar_copias = config.getint("BACKUP", "KEEP", fallback=copias.CONSERVAR)
+        self.paginas_copia = config.getint("BACKUP", "PAGES", fallback=db.PAGINAS_COPIA)
+        self.pausa_copia = config.getfloat("BACKUP", "PAUSE", fallback=db.PAUSA_COPIA)
+
+    def auditar(self, accion):
+        '''Add an action to the audit trail'''
+        self.auditoria.registrar(USUARIO, accion)
+
+    def cerrar(self):
+        '''Write the pending audit events and close the database'''
+        self.auditoria.cerrar()
+        self.database.close()
+
+
+################################################################################
+# Jobs. Each one receives the application and the parsed arguments, and returns
+# the data of the result event
+
+def exportar(app, argumentos):
+    '''Export every register, a date range, the ones from a date or the changes
+        since the last export
+    '''
+    import exportador
+    if argumentos.particion:
+        nombre = argumentos.salida or nombre_extraccion(
+            "Extracción", argumentos.desde, argumentos.hasta).replace(".xlsx", f" por {argumentos.particion}")
+        total = exportador.exportar_particionado(
+            app.database, nombre, app.cabeceras, argumentos.particion, argumentos.desde,
+            argumentos.hasta, argumentos.procesos,
+            progreso=lambda hechos, registros: emitir("progreso", hechos=hechos, total=registros))
+        app.auditar(f"Exportar {nombre} ({total} registros)")
+    elif argumentos.cambios:
+        nombre = argumentos.salida or (
+            "Extracción global.xlsx" if argumentos.anadir else exportador.nombre_cambios())
+        total = exportador.exportar_cambios(
+            app.database, nombre, app.cabeceras, argumentos.anadir,
+            progreso=lambda hechos: emitir("progreso", hechos=hechos, total=None))
+        app.auditar(f"Exportar cambios a {nombre} ({total} registros)")
+    else:
+        nombre = argumentos.salida or nombre_extraccion("Extracción", argumentos.desde, argumentos.hasta)
+        total = exportador.exportar_registros(
+            app.database, nombre, app.cabeceras, argumentos.desde, argumentos.hasta,
+            progreso=lambda hechos, registros: emitir("progreso", hechos=hechos, total=registros))
+        app.auditar(f"Exportar {nombre} ({total} registros)")
+    return {"archivo": os.path.abspath(nombre), "registros": total}
+
+def importar(app, argumentos):
+    '''Import an Excel file, resuming an interrupted import of the same file unless
+        asked to start again. Several files, or directories, are imported in parallel
+    '''
+    import importador
+    import validacion
+    if len(argumentos.archivos) > 1 or os.path.isdir(argumentos.archivos[0]):
+        return importar_varios(app, argumentos)
+    archivo = argumentos.archivos[0]
+    if not os.path.isfile(archivo):
+        raise FileNotFoundError(f"No existe el archivo {archivo}")
+    if argumentos.desde_cero:
+        importador.descartar_progreso(app.database, archivo)
+    hechas = importador.filas_pendientes(app.database, archivo)
+    if hechas:
+        emitir("reanudacion", filas=hechas)
+    fusion = importador.importar_registros(
+        app.database, archivo, app.cabeceras[1:], validacion.validar_registros,
+        argumentos.lote or app.tam_lote or importador.TAM_LOTE,
+        progreso=lambda hechas, total: emitir("progreso", hechos=hechas, total=total),
+        actualizar=not argumentos.conservar)
+    emitir_fusion(archivo, fusion)
+    app.auditar(f"Importar {archivo} ({fusion.importadas} registros)")
+    return {"archivo": os.path.abspath(archivo), "registros": fusion.importadas}
+
+def importar_varios(app, argumentos):
+    '''Import several files in parallel and report the result of each one. The
+        exit status tells whether any file failed, by wrong data or otherwise
+    '''
+    import importador
+    import validacion
+    archivos = importador.expandir_archivos(argumentos.archivos)
+    for archivo in archivos:
+        if not os.path.isfile(archivo):
+            raise FileNotFoundError(f"No existe el archivo {archivo}")
+        if argumentos.desde_cero:
+            importador.descartar_progreso(app.database, archivo)
+    resultados = importador.importar_archivos(
+        app.database, archivos, app.cabeceras[1:], validacion.validar_registros,
+        argumentos.lote or app.tam_lote or importador.TAM_LOTE, argumentos.procesos,
+        progreso=lambda hechos, total: emitir("progreso", hechos=hechos, total=total),
+        actualizar=not argumentos.conservar)
+
+    codigo = EXITO
+    for resultado in resultados:
+        emitir_fusion(resultado.archivo, resultado.fusion)
+        if resultado.informe is not None:
+            for fallo in resultado.informe.errores:
+                emitir("error_validacion", archivo=os.path.abspath(resultado.archivo), fila=fallo.fila,
+                       columna=fallo.columna, mensaje=fallo.mensaje)
+        emitir("archivo", archivo=os.path.abspath(resultado.archivo), registros=resultado.importadas,
+               filas_guardadas=resultado.filas, error=resultado.error)
+        if resultado:
+            app.auditar(f"Importar {resultado.archivo} ({resultado.importadas} registros)")
+        else:
+            app.auditar(f"Importar {resultado.archivo} fallida ({resultado.filas} filas guardadas): "
+                        f"{resultado.error}")
+        if not resultado:
+            erroneo = resultado.informe is not None and not resultado.informe
+            codigo = max(codigo, ERROR_DATOS if erroneo else ERROR_ARCHIVO)
+    return {"archivos": len(resultados), "registros": sum(r.importadas for r in resultados),
+            "errores": sum(1 for r in resultados if not r), "codigo": codigo}
+
+def error_importacion(error):
+    '''Write an import that can't go on and return its exit status. With wrong
+        data, every error of the report is written, so the file can be fixed
+    '''
+    informe = error.informe
+    if informe is not None:
+        for fallo in informe.errores:
+            emitir("error_validacion", fila=fallo.fila, columna=fallo.columna, mensaje=fallo.mensaje)
+    codigo = ERROR_DATOS if informe is not None else ERROR_ARCHIVO
+    emitir("error", codigo=codigo, mensaje=str(error), filas_guardadas=error.filas)
+    return codigo
+
+def auditar_fallo(app, argumentos, estado, error=None):
+    '''Add a job that has failed or been cancelled, its estado, to the audit trail.
+        Imports add one event per file with the rows already committed, which are
+        kept
+    '''
+    if app is None:
+        return
+    motivo = f": {error}" if error is not None else ""
+    if argumentos.comando != "importar":
+        app.auditar(f"{argumentos.comando.capitalize()} {estado}{motivo}")
+        return
+    import importador
+    for archivo in importador.expandir_archivos(argumentos.archivos):
+        try:
+            filas = importador.filas_pendientes(app.database, archivo)
+        except sqlite3.Error:
+            filas = "?"
+        app.auditar(f"Importar {archivo} {estado} ({filas} filas guardadas){motivo}")
+
+def emitir_fusion(archivo, fusion):
+    '''Write the duplicates and conflicts found while merging a file'''
+    archivo = os.path.abspath(archivo)
+    for fila, identificador, primera in fusion.duplicados:
+        emitir("duplicado", archivo=archivo, fila=fila, identificador=identificador, fila_original=primera)
+    for fila, identificador, id, campos in fusion.conflictos:
+        emitir("conflicto", archivo=archivo, fila=fila, identificador=identificador, id=id, campos=campos)
+    emitir("fusion", archivo=archivo, nuevos=fusion.insertadas, actualizados=fusion.actualizadas,
+           sin_cambios=fusion.identicas, duplicados=len(fusion.duplicados),
+           conflictos=len(fusion.conflictos))
+
+def resumen(app, argumentos):
+    '''Export the summary report, optionally of a date range'''
+    import informes
+    nombre = argumentos.salida or nombre_extraccion("Resumen", argumentos.desde, argumentos.hasta)
+    total = informes.exportar_resumen(
+        app.database, nombre, argumentos.desde, argumentos.hasta,
+        progreso=lambda hechas, hojas: emitir("progreso", hechos=hechas, total=hojas))
+    app.auditar(f"Exportar {nombre} ({total} filas)")
+    return {"archivo": os.path.abspath(nombre), "filas": total}
+
+def copia(app, argumentos):
+    '''Back up the database while it's in use, to the backup directory of the
+        configuration, where only the latest copies are kept, or to a file
+    '''
+    if argumentos.salida:
+        destino = argumentos.salida
+    else:
+        os.makedirs(app.copias, exist_ok=True)
+        destino = os.path.join(app.copias, copias.nombre_copia(app.database, argumentos.compactar))
+    resultado = copias.copiar(
+        app.database, destino, argumentos.compactar, app.paginas_copia, app.pausa_copia,
+        progreso=lambda hechas, paginas: emitir("progreso", hechos=hechas, total=paginas))
+    if not argumentos.salida:
+        for archivo in copias.rotar(app.copias, app.database, app.conservar_copias, argumentos.compactar):
+            emitir("eliminada", archivo=str(archivo))
+    app.auditar(f"Copia de seguridad {resultado.archivo}")
+    return {"archivo": os.path.abspath(resultado.archivo), "bytes": resultado.bytes}
+
+
+def parser():
+    '''Arguments of the command line'''
+    parser = argparse.ArgumentParser(
+        description="Exportaciones, importaciones e informes sin interfaz gráfica. "
+                    "El progreso se escribe en la salida estándar como una línea JSON por evento")
+    parser.add_argument("--config", default=CONFIG, help="archivo de configuración")
+    parser.add_argument("--db", help="base de datos, en lugar de la de la configuración")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    exportacion = comandos.add_parser("exportar", help="exportar registros a Excel")
+    exportacion.add_argument("--desde", type=fecha, help="fecha de entrada inicial, dd-MM-yyyy")
+    exportacion.add_argument("--hasta", type=fecha, help="fecha de entrada final, dd-MM-yyyy")
+    exportacion.add_argument("--cambios", action="store_true",
+                             help="solo los registros nuevos o modificados desde la última exportación")
+    exportacion.add_argument("--anadir", action="store_true",
+                             help="con --cambios, añadirlos como una hoja nueva de la extracción global")
+    exportacion.add_argument("--particion", choices=db.PARTICIONES,
+                             help="un archivo por grupo, escritos en paralelo, más un índice")
+    exportacion.add_argument("--procesos", type=int,
+                             help="con --particion, procesos que escriben los archivos (por defecto, uno por núcleo)")
+    exportacion.add_argument("--salida", help="archivo Excel de destino, o directorio o .zip con --particion")
+    exportacion.set_defaults(trabajo=exportar)
+
+    importacion = comandos.add_parser("importar", help="importar registros desde Excel")
+    importacion.add_argument("archivos", nargs="+", metavar="archivo",
+                             help="archivos Excel o directorios a importar; varios se importan en paralelo")
+    importacion.add_argument("--desde-cero", action="store_true",
+                             help="descartar el progreso de una importación interrumpida del archivo")
+    importacion.add_argument("--lote", type=int, help="filas por transacción")
+    importacion.add_argument("--conservar", action="store_true",
+                             help="no sobrescribir los registros existentes que difieran del archivo")
+    importacion.add_argument("--procesos", type=int,
+                             help="con varios archivos, procesos que los leen (por defecto, uno por núcleo)")
+    importacion.set_defaults(trabajo=importar)
+
+    informe = comandos.add_parser("resumen", help="exportar el informe resumen a Excel")
+    informe.add_argument("--desde", type=fecha, help="fecha de entrada inicial, dd-MM-yyyy")
+    informe.add_argument("--hasta", type=fecha, help="fecha de entrada final, dd-MM-yyyy")
+    informe.add_argument("--salida", help="archivo Excel de destino")
+    informe.set_defaults(trabajo=resumen)
+
+    copia_seguridad = comandos.add_parser("copia", help="copia de seguridad de la base de datos en uso")
+    copia_seguridad.add_argument("--compactar", action="store_true",
+                                 help="copia compacta con VACUUM INTO en lugar de la copia en línea")
+    copia_seguridad.add_argument("--salida", help="archivo de destino, en lugar del directorio de copias")
+    copia_seguridad.set_defaults(trabajo=copia)
+    return parser
+
+def main(args=None):
+    '''Run a job and return its exit status'''
+    analizador = parser()
+    argumentos = analizador.parse_args(args)
+    if getattr(argumentos, "cambios", False) and (argumentos.desde or argumentos.hasta):
+        analizador.error("--cambios no admite --desde ni --hasta")
+    if getattr(argumentos, "cambios", False) and argumentos.particion:
+        analizador.error("--cambios no admite --particion")
+    if getattr(argumentos, "anadir", False) and not argumentos.cambios:
+        analizador.error("--anadir necesita --cambios")
+    if getattr(argumentos, "hasta", None) and not argumentos.desde:
+        analizador.error("--hasta necesita --desde")
+
+    inicio = time.perf_counter()
+    app = None
+    try:
+        app = Aplicacion(argumentos.config, argumentos.db)
+        emitir("inicio", comando=argumentos.comando)
+        resultado = argumentos.trabajo(app, argumentos)
+    except sqlite3.Error as error:
+        emitir("error", codigo=ERROR_DB, mensaje=str(error))
+        auditar_fallo(app, argumentos, "fallida", error)
+        return ERROR_DB
+    except OSError as error:
+        emitir("error", codigo=ERROR_ARCHIVO, mensaje=str(error))
+        auditar_fallo(app, argumentos, "fallida", error)
+        return ERROR_ARCHIVO
+    except KeyboardInterrupt:
+        # Interrupted with Ctrl+C or SIGINT, like a job cancelled from the GUI
+        emitir("error", codigo=CANCELADO, mensaje="Cancelado")
+        auditar_fallo(app, argumentos, "cancelada")
+        return CANCELADO
+    except Exception as error:
+        # Only imports, which have already loaded importador, raise ErrorImportacion
+        if argumentos.comando == "importar":
+            import importador
+            if isinstance(error, importador.ErrorImportacion):
+                auditar_fallo(app, argumentos, "fallida", error)
+                return error_importacion(error)
+        logging.getLogger("cli").exception("Error en %s", argumentos.comando)
+        emitir("error", codigo=ERROR, mensaje=f"{type(error).__name__}: {error}")
+        auditar_fallo(app, argumentos, "fallida", f"{type(error).__name__}: {error}")
+        return ERROR
+    finally:
+        if app is not None:
+            app.cerrar()
+    # A job whose result has a code failed in part, such as some of the files of
+    # an import
+    codigo = resultado.pop("codigo", EXITO)
+    emitir("fin", segundos=round(time.perf_counter() - inicio, 3), **resultado)
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+'''Backups of the database
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the backups of the database, taken while the
+    application is in use. A background thread copies the database every
+    interval with the online backup API of SQLite, in small steps between which
+    the form can keep writing, and optionally writes compacted snapshots with
+    VACUUM INTO. Every copy is checked with PRAGMA integrity_check before it
+    replaces anything, and only the latest copies of each kind are kept.
+Date: 2023-06-30
+'''
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from pathlib import Path
+import db
+
+logger = logging.getLogger("copias")
+
+# Seconds between two backups, and between two compacted snapshots (0 to take none)
+INTERVALO = 3600.0
+INTERVALO_COMPACTA = 0.0
+
+# Number of copies of each kind kept in the directory
+CONSERVAR = 24
+
+# Seconds before trying again a copy that has failed
+REINTENTO = 300.0
+
+# Suffix of the name of the compacted snapshots
+SUFIJO_COMPACTA = "-compacta"
+
+# A finished copy: its file, size in bytes and seconds it took
+Copia = namedtuple("Copia", ["archivo", "bytes", "segundos"])
+
+
+class CopiaCancelada(Exception):
+    '''Exception raised inside a copy when the backups are stopped'''
+
+
+def nombre_copia(database, compactar=False, fecha=None):
+    '''Name of the file of a copy of the database taken at fecha, or now'''
+    fecha = fecha or datetime.now()
+    sufijo = SUFIJO_COMPACTA if compactar else ""
+    return f"{Path(database.pool.db).stem}-{fecha:%Y%m%d-%H%M%S}{sufijo}.db"
+
+def copias_existentes(directorio, database, compactar=False):
+    '''Copies of the database of a kind in a directory, from the oldest to the newest'''
+    sufijo = SUFIJO_COMPACTA if compactar else ""
+    patron = f"{Path(database.pool.db).stem}-{'[0-9]' * 8}-{'[0-9]' * 6}{sufijo}.db"
+    return sorted(Path(directorio).glob(patron))
+
+def rotar(directorio, database, conservar=CONSERVAR, compactar=False):
+    '''Delete the oldest copies of a kind, keeping the latest conservar. Returns
+        the deleted files
+    '''
+    copias = copias_existentes(directorio, database, compactar)
+    sobrantes = copias[:-conservar] if conservar > 0 else []
+    for archivo in sobrantes:
+        archivo.unlink()
+        logger.info("Copia antigua eliminada: %s", archivo)
+    return sobrantes
+
+def comprobar_integridad(archivo):
+    '''Run PRAGMA integrity_check on a copy, read-only. Raises sqlite3.DatabaseError
+        with the problems found if it isn't correct
+    '''
+    conn = sqlite3.connect(f"{Path(archivo).absolute().as_uri()}?mode=ro", uri=True)
+    try:
+        problemas = [fila[0] for fila in conn.execute("PRAGMA integrity_check")]
+    finally:
+        conn.close()
+    if problemas != ["ok"]:
+        raise sqlite3.DatabaseError(f"La copia {archivo} está dañada: {'; '.join(problemas[:10])}")
+
+def copiar(database, destino, compactar=False, paginas=db.PAGINAS_COPIA, pausa=db.PAUSA_COPIA,
+           progreso=None):
+    '''Copy the database to destino, online or compacted with VACUUM INTO, and
+        check the copy. It's written to a temporary file first, which is deleted if
+        anything fails or progreso raises an exception, so destino is either a
+        complete and correct copy or isn't changed
+    '''
+    parcial = Path(f"{destino}.parcial")
+    inicio = time.perf_counter()
+    parcial.unlink(missing_ok=True)
+    try:
+        if compactar:
+            database.vacuum_into(parcial, progreso)
+        else:
+            database.backup(parcial, paginas, pausa, progreso)
+        comprobar_integridad(parcial)
+        os.replace(parcial, destino)
+    except BaseException:
+        parcial.unlink(missing_ok=True)
+        Path(f"{parcial}-journal").unlink(missing_ok=True)
+        raise
+    copia = Copia(str(destino), os.path.getsize(destino), time.perf_counter() - inicio)
+    logger.info("Copia %s: %s (%d bytes, %.3f s)", "compacta" if compactar else "de seguridad",
+                copia.archivo, copia.bytes, copia.segundos)
+    return copia
+
+
+class CopiasSeguridad:
+    '''Scheduled backups of a database in a directory. A background thread takes
+        a copy every intervalo seconds and a compacted snapshot every
+        intervalo_compacta seconds, counting from the newest copy of each kind
+        in the directory, so a copy overdue when the application starts is taken
+        right away
+    '''
+    def __init__(self, database, directorio, intervalo=INTERVALO, conservar=CONSERVAR,
+                 intervalo_compacta=INTERVALO_COMPACTA, paginas=db.PAGINAS_COPIA,
+                 pausa=db.PAUSA_COPIA):
+        '''Constructor. Creates the directory and starts the backup thread'''
+        self.database = database
+        self.directorio = Path(directorio)
+        self.conservar = conservar
+        self.paginas = paginas
+        self.pausa = pausa
+        self.intervalos = {False: intervalo, True: intervalo_compacta}
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self._ultima = {compactar: self._ultima_copia(compactar) for compactar in self.intervalos}
+        self._bloqueo = threading.Lock()
+        self._fin = threading.Event()
+        self._hilo = threading.Thread(target=self._programar, name="copias", daemon=True)
+        self._hilo.start()
+
+    def copiar(self, compactar=False, progreso=None):
+        '''Take a copy now, delete the oldest ones of its kind and return the
+            Copia. A single copy is taken at a time
+        '''
+        def paso(hecho, total):
+            if self._fin.is_set():
+                raise CopiaCancelada()
+            if progreso is not None:
+                progreso(hecho, total)
+
+        with self._bloqueo:
+            self._ultima[compactar] = time.time()
+            destino = self.directorio / nombre_copia(self.database, compactar)
+            copia = copiar(self.database, destino, compactar, self.paginas, self.pausa, paso)
+            rotar(self.directorio, self.database, self.conservar, compactar)
+            return copia
+
+    def cerrar(self):
+        '''Stop the backup thread, cancelling the copy in progress'''
+        if self._hilo.is_alive():
+            self._fin.set()
+            self._hilo.join()
+
+    def _ultima_copia(self, compactar):
+        '''Time of the newest copy of a kind in the directory, or 0 if there's none'''
+        copias = copias_existentes(self.directorio, self.database, compactar)
+        return copias[-1].stat().st_mtime if copias else 0.0
+
+    def _programar(self):
+        '''Backup thread: wait for the next copy due and take it'''
+        while True:
+            programadas = [(self._ultima[compactar] + intervalo, compactar)
+                           for compactar, intervalo in self.intervalos.items() if intervalo > 0]
+            if not programadas:
+                return
+            cuando, compactar = min(programadas)
+            if self._fin.wait(max(0.0, cuando - time.time())):
+                return
+            try:
+                self.copiar(compactar)
+            except CopiaCancelada:
+                return
+            except (sqlite3.Error, OSError) as error:
+                logger.error("No se ha podido hacer la copia de seguridad: %s", error)
+                # Try again after a while, instead of waiting a whole interval
+                intervalo = self.intervalos[compactar]
+                self._ultima[compactar] = time.time() - intervalo + min(REINTENTO, intervalo)
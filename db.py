@@ -3,142 +3,1057 @@
 Author: Alejandro Sanchez Rodriguez
 Description: This class is used to manage the database. It contains methods to 
     create the tables, insert, read, edit and delete data.
+    Dates are stored in the sortable ISO format (yyyy-MM-dd) and shown to the
+    user as dd-MM-yyyy. The schema is versioned with PRAGMA user_version and
+    upgraded by the migrations in MIGRACIONES.
+    Connections come from a PoolConexiones with a single writer and several
+    readers, so the database can be used from worker threads.
 Date: 2023-06-30
 '''
 
+import queue
 import sqlite3
-import numpy as np
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+from datetime import date
+from operator import attrgetter
+from instrumentacion import ConexionInstrumentada, Estadisticas, instrumentar_metodos
 
+# Number of rows fetched from the database on each round-trip when streaming
+CHUNK_SIZE = 5000
 
-class Database:
-    def __init__(self, db):
+# Default number of reader connections of the pool
+LECTORES = 4
+
+# Pages copied on each step of an online backup, and seconds the writer
+# connection is released between two steps so the form can keep writing
+PAGINAS_COPIA = 256
+PAUSA_COPIA = 0.01
+
+# Virtual machine instructions between two progress reports of VACUUM INTO
+INSTRUCCIONES_PROGRESO = 100000
+
+# SQLite pragmas that can be tuned from the [DB] section of config.ini
+PRAGMAS = ["journal_mode", "synchronous", "cache_size", "mmap_size", "temp_store"]
+
+# Definition of the tables
+TABLA_USUARIOS = "CREATE TABLE IF NOT EXISTS usuarios \
+    (id INTEGER PRIMARY KEY, nombre TEXT, usuario TEXT)"
+TABLA_REGISTROS = "CREATE TABLE IF NOT EXISTS registros \
+    (id INTEGER PRIMARY KEY, fechaEntrada DATETIME, operador TEXT, identificador TEXT, importe REAL, \
+    estado TEXT, x TEXT, num_llamadas INTEGER, fechaResolucion DATETIME, operadorResolucion TEXT, \
+    observaciones TEXT)"
+TABLA_IMPORTACIONES = "CREATE TABLE IF NOT EXISTS importaciones \
+    (archivo TEXT PRIMARY KEY, filas INTEGER, fecha DATETIME)"
+TABLA_LOGS = "CREATE TABLE IF NOT EXISTS logs \
+    (id INTEGER PRIMARY KEY, fecha DATETIME, usuario TEXT, accion TEXT)"
+TABLA_METADATOS = "CREATE TABLE IF NOT EXISTS metadatos (clave TEXT PRIMARY KEY, valor)"
+TABLA_IMPORTACIONES_VISTOS = "CREATE TABLE IF NOT EXISTS importaciones_vistos \
+    (archivo TEXT, identificador TEXT, fila INTEGER, PRIMARY KEY (archivo, identificador)) WITHOUT ROWID"
+
+# Columns of registros as they are read, with the dates in the dd-MM-yyyy format
+COLUMNAS_REGISTROS = "id, strftime('%d-%m-%Y', fechaEntrada), operador, identificador, importe, \
+    estado, x, num_llamadas, strftime('%d-%m-%Y', fechaResolucion), operadorResolucion, observaciones"
+
+# Columns of registros, in the order in which they are read
+CAMPOS_REGISTROS = ["id", "fechaEntrada", "operador", "identificador", "importe", "estado", "x",
+                    "num_llamadas", "fechaResolucion", "operadorResolucion", "observaciones"]
+
+# Columns of registros with dates, stored as yyyy-MM-dd
+CAMPOS_FECHA = ["fechaEntrada", "fechaResolucion"]
+
+# Statement that inserts a register, given its values without id
+INSERTAR_REGISTRO = f"INSERT INTO registros ({', '.join(CAMPOS_REGISTROS[1:])}) \
+    VALUES ({', '.join('?' * (len(CAMPOS_REGISTROS) - 1))})"
+
+# Statement that inserts a register or, if there's already one with its
+# identificador, updates it
+UPSERT_REGISTRO = INSERTAR_REGISTRO + " ON CONFLICT (identificador) DO UPDATE SET " \
+    + ", ".join(f"{campo} = excluded.{campo}" for campo in CAMPOS_REGISTROS[1:] if campo != "identificador")
+
+# Temporary tables of the writer connection where the imported registers are
+# staged before being merged into registros: the rows of the current batch, with
+# the row of the file where they come from, their type once classified and the
+# row or id they match. The identificadores already seen in each file are kept
+# in importaciones_vistos, so they outlive the connection like the progress
+TABLAS_STAGING = [
+    "CREATE TEMP TABLE IF NOT EXISTS staging_registros \
+        (fila INTEGER PRIMARY KEY, fechaEntrada DATETIME, operador TEXT, identificador TEXT, \
+        importe REAL, estado TEXT, x TEXT, num_llamadas INTEGER, fechaResolucion DATETIME, \
+        operadorResolucion TEXT, observaciones TEXT, tipo TEXT, coincidencia INTEGER)",
+    "CREATE INDEX IF NOT EXISTS temp.idx_staging_identificador ON staging_registros (identificador)",
+]
+INSERTAR_STAGING = f"INSERT INTO staging_registros (fila, {', '.join(CAMPOS_REGISTROS[1:])}) \
+    VALUES ({', '.join('?' * len(CAMPOS_REGISTROS))})"
+
+# Columns compared between a staged register and the existing one
+CAMPOS_FUSION = [campo for campo in CAMPOS_REGISTROS[1:] if campo != "identificador"]
+
+# Result of merging a batch of imported registers: how many were inserted,
+# updated and left as they were because nothing changed, the rows repeated in
+# the file as (row, identificador, row where it first appeared) and the ones
+# that differ from the existing register as (row, identificador, id, columns)
+ResultadoFusion = namedtuple("ResultadoFusion",
+                             ["insertadas", "actualizadas", "identicas", "duplicados", "conflictos"])
+
+# Keys of metadatos with the high-water mark of the last export: the last id
+# exported and the last modification exported
+MARCA_EXPORTACION = ("exportacion_id", "exportacion_modificado")
+
+# Indexed columns of registros by which they can be browsed with keyset pagination
+ORDENES = ["id", "fechaEntrada", "identificador", "estado", "operador"]
+
+# Default number of registers of a page
+TAM_PAGINA = 100
+
+# Groupings of the summary reports: the indexed column aggregated first, the
+# expression shown for each group and the one by which the groups are made and sorted
+AGRUPACIONES = {
+    "operador": ("operador", "operador", "operador"),
+    "estado": ("estado", "estado", "estado"),
+    "dia": ("fechaEntrada", "strftime('%d-%m-%Y', fechaEntrada)", "fechaEntrada"),
+    "semana": ("fechaEntrada", "strftime('%Y', fechaEntrada) || '-S' || strftime('%W', fechaEntrada)",
+               "strftime('%Y-%W', fechaEntrada)"),
+    "mes": ("fechaEntrada", "strftime('%m-%Y', fechaEntrada)", "strftime('%Y-%m', fechaEntrada)"),
+}
+
+# Groupings of AGRUPACIONES by which an export can be split into several files
+PARTICIONES = ["mes", "operador"]
+
+# Converts a dd-MM-yyyy date stored as text to yyyy-MM-dd
+_A_ISO = "substr({0}, 7, 4) || '-' || substr({0}, 4, 2) || '-' || substr({0}, 1, 2)"
+_FORMATO_FECHA = "'[0-9][0-9]-[0-9][0-9]-[0-9][0-9][0-9][0-9]'"
+
+# Schema migrations. The migration at position i upgrades the schema from version
+# i to version i + 1, and the current version is kept in PRAGMA user_version.
+# New migrations must always be appended at the end
+MIGRACIONES = [
+    # 1: base tables
+    ";".join([TABLA_USUARIOS, TABLA_REGISTROS, TABLA_IMPORTACIONES, TABLA_LOGS]),
+    # 2: ISO dates, so they sort correctly and range queries can use an index
+    f"""
+    UPDATE registros SET fechaEntrada = {_A_ISO.format("fechaEntrada")}
+        WHERE fechaEntrada GLOB {_FORMATO_FECHA};
+    UPDATE registros SET fechaResolucion = {_A_ISO.format("fechaResolucion")}
+        WHERE fechaResolucion GLOB {_FORMATO_FECHA};
+    CREATE INDEX IF NOT EXISTS idx_registros_identificador ON registros (identificador);
+    CREATE INDEX IF NOT EXISTS idx_registros_fecha_entrada ON registros (fechaEntrada);
+    CREATE INDEX IF NOT EXISTS idx_registros_estado ON registros (estado);
+    CREATE INDEX IF NOT EXISTS idx_registros_operador ON registros (operador);
+    """,
+    # 3: full-text search over the text fields, an external-content FTS5 table
+    # kept in sync with registros by triggers
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS registros_fts USING fts5(
+        identificador, operador, observaciones,
+        content='registros', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3');
+    CREATE TRIGGER IF NOT EXISTS registros_fts_insert AFTER INSERT ON registros BEGIN
+        INSERT INTO registros_fts (rowid, identificador, operador, observaciones)
+            VALUES (new.id, new.identificador, new.operador, new.observaciones);
+    END;
+    CREATE TRIGGER IF NOT EXISTS registros_fts_delete AFTER DELETE ON registros BEGIN
+        INSERT INTO registros_fts (registros_fts, rowid, identificador, operador, observaciones)
+            VALUES ('delete', old.id, old.identificador, old.operador, old.observaciones);
+    END;
+    CREATE TRIGGER IF NOT EXISTS registros_fts_update
+        AFTER UPDATE OF identificador, operador, observaciones ON registros BEGIN
+        INSERT INTO registros_fts (registros_fts, rowid, identificador, operador, observaciones)
+            VALUES ('delete', old.id, old.identificador, old.operador, old.observaciones);
+        INSERT INTO registros_fts (rowid, identificador, operador, observaciones)
+            VALUES (new.id, new.identificador, new.operador, new.observaciones);
+    END;
+    INSERT INTO registros_fts (registros_fts) VALUES ('rebuild');
+    """,
+    # 4: covering indexes for the summary reports. The grouped columns keep id
+    # right after them, so keyset pagination still reads them in order, and the
+    # INCIDENCIA registers get a partial index of their own
+    """
+    DROP INDEX IF EXISTS idx_registros_fecha_entrada;
+    DROP INDEX IF EXISTS idx_registros_estado;
+    DROP INDEX IF EXISTS idx_registros_operador;
+    CREATE INDEX idx_registros_fecha_entrada ON registros (fechaEntrada, id, importe);
+    CREATE INDEX idx_registros_estado ON registros (estado, id, importe);
+    CREATE INDEX idx_registros_operador ON registros (operador, id, importe);
+    CREATE INDEX IF NOT EXISTS idx_registros_incidencias
+        ON registros (fechaEntrada, operador, num_llamadas) WHERE estado = 'INCIDENCIA';
+    """,
+    # 5: modification time of the registers, so the exports can be incremental.
+    # New registers are found by id, so only updates set it, and the metadatos
+    # table keeps the high-water mark of the last export
+    f"""
+    ALTER TABLE registros ADD COLUMN modificado DATETIME;
+    CREATE INDEX IF NOT EXISTS idx_registros_modificado ON registros (modificado)
+        WHERE modificado IS NOT NULL;
+    CREATE TRIGGER IF NOT EXISTS registros_modificado
+        AFTER UPDATE OF {', '.join(CAMPOS_REGISTROS[1:])} ON registros BEGIN
+        UPDATE registros SET modificado = strftime('%Y-%m-%d %H:%M:%f', 'now') WHERE id = new.id;
+    END;
+    {TABLA_METADATOS};
+    """,
+    # 6: identificador is unique, so a register can be found and updated by it.
+    # Older duplicates are moved to registros_duplicados, keeping the newest one
+    """
+    CREATE TABLE IF NOT EXISTS registros_duplicados AS SELECT * FROM registros WHERE 0;
+    INSERT INTO registros_duplicados SELECT * FROM registros
+        WHERE identificador IS NOT NULL AND id NOT IN (
+            SELECT MAX(id) FROM registros WHERE identificador IS NOT NULL GROUP BY identificador);
+    DELETE FROM registros WHERE id IN (SELECT id FROM registros_duplicados);
+    DROP INDEX IF EXISTS idx_registros_identificador;
+    CREATE UNIQUE INDEX idx_registros_identificador ON registros (identificador);
+    """,
+    # 7: indexes of the audit trail, to read it by user and by time
+    """
+    CREATE INDEX IF NOT EXISTS idx_logs_usuario_fecha ON logs (usuario, fecha);
+    CREATE INDEX IF NOT EXISTS idx_logs_fecha ON logs (fecha);
+    """,
+    # 8: identificadores seen by the imports in progress, so a resumed import
+    # still finds the rows repeated in the batches committed before
+    TABLA_IMPORTACIONES_VISTOS,
+]
+
+
+def fecha_iso(fecha):
+    '''Convert a dd-MM-yyyy date, or a date object, to the yyyy-MM-dd format in
+        which dates are stored. Any other value is returned unchanged
+    '''
+    if isinstance(fecha, date):
+        return fecha.strftime("%Y-%m-%d")
+    if isinstance(fecha, str) and len(fecha) == 10 and fecha[2] == "-" and fecha[5] == "-":
+        return f"{fecha[6:]}-{fecha[3:5]}-{fecha[:2]}"
+    return fecha
+
+def consulta_fts(texto):
+    '''Turn the text typed by the user into an FTS5 query that matches every word
+        as a prefix. Each word is quoted, so the FTS5 syntax can't be injected
+    '''
+    palabras = ['"' + palabra.replace('"', '""') + '"*' for palabra in texto.split()]
+    return " ".join(palabras)
+
+def parametros_registro(values):
+    '''Typed values of a register, without id, in the order of the columns of
+        registros: dates in ISO format, importe as a float and num_llamadas as an
+        integer, so they keep the affinity of their columns. Empty numbers and
+        dates are stored as NULL. values can be a Registro or the values of the
+        form or of an Excel row
+    '''
+    if isinstance(values, Registro):
+        return values.parametros()
+    values = list(values[:10])
+    values += [None] * (10 - len(values))
+    return (fecha_iso(values[0]) or None, values[1], values[2], _numero(values[3], float),
+            values[4], values[5], _numero(values[6], int), fecha_iso(values[7]) or None,
+            values[8], values[9])
+
+def _numero(valor, tipo):
+    '''Convert a number read from the form or from Excel to tipo, or None if it's empty'''
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return None
+    return tipo(float(valor)) if tipo is int else tipo(valor)
+
+def fila_registro(cursor, fila):
+    '''Row factory that reads the rows of COLUMNAS_REGISTROS as Registro objects'''
+    return Registro(*fila)
+
+
+class Registro:
+    '''A register of the registros table, with one attribute per column. It uses
+        __slots__, so it takes about as much memory as a tuple, and it can still be
+        iterated and indexed like the rows it replaces
+    '''
+    __slots__ = tuple(CAMPOS_REGISTROS)
+    _valores = attrgetter(*CAMPOS_REGISTROS)
+
+    def __init__(self, id=None, fechaEntrada=None, operador=None, identificador=None,
+                 importe=None, estado=None, x=None, num_llamadas=None, fechaResolucion=None,
+                 operadorResolucion=None, observaciones=None):
         '''Constructor'''
-        self.conn = sqlite3.connect(db)
-        self.cur = self.conn.cursor()
-    
+        self.id = id
+        self.fechaEntrada = fechaEntrada
+        self.operador = operador
+        self.identificador = identificador
+        self.importe = importe
+        self.estado = estado
+        self.x = x
+        self.num_llamadas = num_llamadas
+        self.fechaResolucion = fechaResolucion
+        self.operadorResolucion = operadorResolucion
+        self.observaciones = observaciones
+
+    @classmethod
+    def desde_valores(cls, values, id=None):
+        '''Build a register from the values of the form or of an Excel row, with
+            their types converted as they are stored
+        '''
+        return cls(id, *parametros_registro(values))
+
+    def parametros(self):
+        '''Values of the register without id, to insert it'''
+        return self._valores(self)[1:]
+
+    def __iter__(self):
+        return iter(self._valores(self))
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __getitem__(self, indice):
+        return self._valores(self)[indice]
+
+    def __eq__(self, otro):
+        if isinstance(otro, (Registro, tuple)):
+            return tuple(self) == tuple(otro)
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Registro{self._valores(self)!r}"
+
+
+class PoolConexiones:
+    '''Pool of connections to a database: a single writer connection, shared
+        through a lock so writes never compete, and up to lectores reader
+        connections, each one used by a single thread at a time. A thread that is
+        already using a connection gets the same one again, so reads inside a
+        write transaction see its uncommitted changes
+    '''
+    def __init__(self, db, lectores=LECTORES, pragmas=None, estadisticas=None, umbral_lentas=None,
+                 solo_lectura=False):
+        '''Constructor. Every statement is added to estadisticas, and the ones
+            slower than umbral_lentas seconds are logged. With solo_lectura every
+            connection, the writer one included, is opened read-only
+        '''
+        self.db = db
+        self.pragmas = pragmas or {}
+        self.solo_lectura = solo_lectura
+        self.estadisticas = estadisticas if estadisticas is not None else Estadisticas()
+        self.umbral_lentas = umbral_lentas
+        for nombre, valor in self.pragmas.items():
+            if nombre.lower() not in PRAGMAS:
+                raise ValueError(f"Pragma no permitido: {nombre}")
+            if not str(valor).lstrip("-").isalnum():
+                raise ValueError(f"Valor no permitido para {nombre}: {valor}")
+        self._local = threading.local()
+        self._bloqueo = threading.RLock()
+        self._bloqueo_conexiones = threading.Lock()
+        self._conexiones = []
+        self._escritor = self._conectar()
+        # An in-memory database only exists in its own connection
+        self._compartida = db == ":memory:"
+        self._libres = queue.LifoQueue()
+        self._lectores = threading.BoundedSemaphore(max(lectores, 1))
+
+    def _conectar(self):
+        '''Open a new connection with the configured pragmas'''
+        if self.solo_lectura:
+            conn = sqlite3.connect(f"{Path(self.db).absolute().as_uri()}?mode=ro", uri=True,
+                                   check_same_thread=False, factory=ConexionInstrumentada)
+        else:
+            conn = sqlite3.connect(self.db, check_same_thread=False, factory=ConexionInstrumentada)
+        conn.estadisticas = self.estadisticas
+        conn.umbral_lentas = self.umbral_lentas
+        for nombre, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {nombre} = {valor}")
+        with self._bloqueo_conexiones:
+            self._conexiones.append(conn)
+        return conn
+
+    @contextmanager
+    def _usar(self, conn):
+        '''Mark a connection as the one in use by the current thread'''
+        anterior = getattr(self._local, "conexion", None)
+        self._local.conexion = conn
+        try:
+            yield conn
+        finally:
+            self._local.conexion = anterior
+
+    @contextmanager
+    def escritor(self):
+        '''Borrow the writer connection, blocking other writers meanwhile'''
+        with self._bloqueo, self._usar(self._escritor) as conn:
+            yield conn
+
+    def ceder_escritor(self, segundos):
+        '''Release the writer connection borrowed by the current thread for a
+            while, so other threads can write, and borrow it again
+        '''
+        self._bloqueo.release()
+        try:
+            time.sleep(segundos)
+        finally:
+            self._bloqueo.acquire()
+
+    @contextmanager
+    def lector(self):
+        '''Borrow a reader connection for the current thread'''
+        actual = getattr(self._local, "conexion", None)
+        if actual is not None:
+            yield actual
+            return
+        if self._compartida:
+            with self.escritor() as conn:
+                yield conn
+            return
+        with self._lectores:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                conn = self._conectar()
+            try:
+                with self._usar(conn):
+                    yield conn
+            finally:
+                self._libres.put(conn)
+
+    def cerrar(self):
+        '''Close every connection of the pool'''
+        with self._bloqueo, self._bloqueo_conexiones:
+            for conn in self._conexiones:
+                conn.close()
+            self._conexiones = []
+
+
+# Every public method keeps statistics of its calls, except the ones that return
+# iterators or context managers, whose time is spent after they return
+@instrumentar_metodos(excepto=("transaction", "iter_registros", "iter_particion", "iter_cambios",
+                               "close", "get_estadisticas", "reset_estadisticas"))
+class Database:
+    def __init__(self, db, pragmas=None, lectores=LECTORES, umbral_lentas=None, solo_lectura=False):
+        '''Constructor. pragmas is a dictionary with the values of the PRAGMAS to
+            apply to every connection, such as {"journal_mode": "WAL"}, lectores
+            the maximum number of threads reading at the same time,
+            umbral_lentas the seconds from which a statement is logged as slow and
+            solo_lectura whether the database is opened read-only
+        '''
+        self.estadisticas_metodos = Estadisticas()
+        self.estadisticas_sentencias = Estadisticas()
+        self.pool = PoolConexiones(db, lectores, pragmas, self.estadisticas_sentencias, umbral_lentas,
+                                   solo_lectura)
+        self._transacciones = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def __del__(self):
         '''Destructor'''
-        self.conn.close()
+        if hasattr(self, "pool"):
+            self.pool.cerrar()
+
+    def close(self):
+        '''Close every connection to the database'''
+        self.pool.cerrar()
+
+    def get_estadisticas(self):
+        '''Snapshot of the statistics kept in memory: calls, seconds, maximum and
+            average seconds and rows of every method and of every statement
+        '''
+        return {"metodos": self.estadisticas_metodos.instantanea(),
+                "sentencias": self.estadisticas_sentencias.instantanea()}
+
+    def reset_estadisticas(self):
+        '''Set the statistics back to zero'''
+        self.estadisticas_metodos.reiniciar()
+        self.estadisticas_sentencias.reiniciar()
+
+    def get_pragmas(self):
+        '''Read the current value of the tunable pragmas'''
+        with self.pool.lector() as conn:
+            return {nombre: conn.execute(f"PRAGMA {nombre}").fetchone()[0] for nombre in PRAGMAS}
+
+    @contextmanager
+    def transaction(self):
+        '''Group several operations in a single transaction on the writer
+            connection, which is yielded. The changes are committed once, when the
+            outermost block ends, or rolled back if it raises an exception
+        '''
+        with self.pool.escritor() as conn:
+            self._transacciones += 1
+            try:
+                yield conn
+            except BaseException:
+                self._transacciones -= 1
+                if not self._transacciones:
+                    conn.rollback()
+                raise
+            self._transacciones -= 1
+            if not self._transacciones:
+                conn.commit()
 
     def query(self, query):
         '''Execute a query passed as a parameter'''
-        self.cur.execute(query)
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute(query)
+
+    def get_version(self):
+        '''Read the version of the database schema'''
+        with self.pool.lector() as conn:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self):
+        '''Apply the pending migrations, each one in its own transaction together
+            with the new schema version. Returns the resulting version
+        '''
+        with self.pool.escritor() as conn:
+            version = self.get_version()
+            for numero, migracion in enumerate(MIGRACIONES[version:], version + 1):
+                try:
+                    conn.executescript(f"BEGIN; {migracion}; PRAGMA user_version = {numero}; COMMIT;")
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+            return self.get_version()
 
 
     ############################################################################
     def create_table_usuarios(self):
         '''Create a table called usuarios with the following fields: id, nombre, usuario'''
-        self.cur.execute("CREATE TABLE IF NOT EXISTS usuarios \
-                        (id INTEGER PRIMARY KEY, nombre TEXT, usuario TEXT)")
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute(TABLA_USUARIOS)
     
     def create_table_registros(self):
         '''Create a table called registros that stores every registered task
             The table called registros has following fields:
                 id (integer, primary key),
-                fechaEntrada (datetime),
+                fechaEntrada (datetime, yyyy-MM-dd),
                 operador (text),
                 identificador (text),
                 importe (real),
                 estado (text),
                 x (text),
                 num_llamadas (integer),
-                fechaResolucion (datetime),
+                fechaResolucion (datetime, yyyy-MM-dd),
                 operadorResolucion (text),
                 observaciones (text)
         '''
-        self.cur.execute("CREATE TABLE IF NOT EXISTS registros \
-                        (id INTEGER PRIMARY KEY, fechaEntrada DATETIME, operador TEXT, identificador TEXT, importe REAL,\
-                        estado TEXT, x TEXT, num_llamadas INTEGER, fechaResolucion DATETIME, operadorResolucion TEXT, \
-                        observaciones TEXT)")
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute(TABLA_REGISTROS)
+
+    def create_table_importaciones(self):
+        '''Create a table called importaciones that keeps, for every interrupted import,
+            the number of rows of the file already committed: archivo, filas, fecha
+        '''
+        with self.transaction() as conn:
+            conn.execute(TABLA_IMPORTACIONES)
+
+    def create_table_importaciones_vistos(self):
+        '''Create a table called importaciones_vistos that keeps the identificadores
+            already merged by every import in progress: archivo, identificador, fila
+        '''
+        with self.transaction() as conn:
+            conn.execute(TABLA_IMPORTACIONES_VISTOS)
 
     def create_table_logs(self):
         '''Create a table called logs with the following fields: id, fecha, usuario, accion'''
-        self.cur.execute("CREATE TABLE IF NOT EXISTS logs \
-                        (id INTEGER PRIMARY KEY, fecha DATETIME, usuario TEXT, accion TEXT)")
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute(TABLA_LOGS)
+
+    def create_table_metadatos(self):
+        '''Create a table called metadatos with the following fields: clave, valor'''
+        with self.transaction() as conn:
+            conn.execute(TABLA_METADATOS)
 
 
     ############################################################################
     def insert_usuario(self, nombre, usuario):
         '''Insert a new user'''
-        self.cur.execute("INSERT INTO usuarios VALUES (NULL, ?, ?)", (nombre, usuario))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO usuarios VALUES (NULL, ?, ?)", (nombre, usuario))
     
     def get_all_usuarios(self):
         '''Read all users'''
-        self.cur.execute("SELECT * FROM usuarios")
-        rows = self.cur.fetchall()
-        return rows
+        with self.pool.lector() as conn:
+            return conn.execute("SELECT * FROM usuarios").fetchall()
     
     def edit_usuario(self, id, nombre, usuario):
         '''Edit a user'''
-        self.cur.execute("UPDATE usuarios SET nombre = ?, usuario = ? WHERE id = ?", (nombre, usuario, id))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("UPDATE usuarios SET nombre = ?, usuario = ? WHERE id = ?", (nombre, usuario, id))
 
     def delete_usuario(self, id):
         '''Delete a user'''
-        self.cur.execute("DELETE FROM usuarios WHERE id = ?", (id,))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM usuarios WHERE id = ?", (id,))
 
 
     ############################################################################
     def get_all_registros(self):
         '''Read all registers'''
-        self.cur.execute("SELECT * FROM registros")
-        rows = self.cur.fetchall()
-        return rows
+        with self.pool.lector() as conn:
+            return self._registros(conn, f"SELECT {COLUMNAS_REGISTROS} FROM registros")
     
     def get_registro(self, id):
         '''Read a single register'''
-        self.cur.execute("SELECT * FROM registros WHERE id = ?", (id,))
-        rows = self.cur.fetchall()
-        return rows
+        with self.pool.lector() as conn:
+            return self._registros(conn, f"SELECT {COLUMNAS_REGISTROS} FROM registros WHERE id = ?", (id,))
 
     def get_registro_by(self, parameter, value):
-        '''Read a single register by a given parameter'''
-        self.cur.execute("SELECT * FROM registros WHERE ? = ?", (parameter, value))
-        rows = self.cur.fetchall()
-        return rows
+        '''Read the registers with a given value in a column. Only the values of
+            the date columns are converted from dd-MM-yyyy
+        '''
+        if parameter not in CAMPOS_REGISTROS:
+            raise ValueError(f"No existe el campo {parameter}")
+        with self.pool.lector() as conn:
+            return self._registros(conn, f"SELECT {COLUMNAS_REGISTROS} FROM registros WHERE {parameter} = ?",
+                                   (fecha_iso(value) if parameter in CAMPOS_FECHA else value,))
+
+    def search_registros(self, texto, limite=TAM_PAGINA):
+        '''Search the registers whose identificador, operador or observaciones
+            contain every word of texto, or words starting with them, sorted by
+            relevance
+        '''
+        consulta = consulta_fts(texto)
+        if not consulta:
+            return []
+        with self.pool.lector() as conn:
+            return self._registros(
+                conn,
+                f"SELECT {COLUMNAS_REGISTROS} FROM registros JOIN \
+                    (SELECT rowid, rank FROM registros_fts WHERE registros_fts MATCH ? \
+                        ORDER BY rank LIMIT ?) AS fts ON registros.id = fts.rowid \
+                ORDER BY fts.rank",
+                (consulta, limite))
     
     def get_all_registros_fecha_entrada(self, rango):
         '''Read all registers within a fecha_entrada range'''
-        self.cur.execute("SELECT * FROM registros WHERE fechaEntrada BETWEEN ? AND ?",
-                        (rango[0], rango[1]))
-        rows = self.cur.fetchall()
-        return rows
+        with self.pool.lector() as conn:
+            return self._registros(
+                conn, f"SELECT {COLUMNAS_REGISTROS} FROM registros WHERE fechaEntrada BETWEEN ? AND ?",
+                (fecha_iso(rango[0]), fecha_iso(rango[1])))
     
+    def _registros(self, conn, query, params=()):
+        '''Read the registers returned by a query of COLUMNAS_REGISTROS as Registro objects'''
+        cur = conn.cursor()
+        cur.row_factory = fila_registro
+        try:
+            return cur.execute(query, params).fetchall()
+        finally:
+            cur.close()
+
+    def count_registros(self, desde=None, hasta=None):
+        '''Count the registers, optionally from (and up to) a fecha_entrada'''
+        where, params = self._filtro_fecha_entrada(desde, hasta)
+        with self.pool.lector() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM registros{where}", params).fetchone()[0]
+
+    def iter_registros(self, desde=None, hasta=None, chunk_size=CHUNK_SIZE):
+        '''Iterate over the registers, optionally from (and up to) a fecha_entrada,
+            fetching them in chunks so the whole table is never held in memory.
+            The rows are plain tuples, so streaming them to Excel costs a single
+            allocation per row. The reader connection is kept until the iteration ends
+        '''
+        where, params = self._filtro_fecha_entrada(desde, hasta)
+        return self._iterar(f"SELECT {COLUMNAS_REGISTROS} FROM registros{where}", params, chunk_size)
+
+    def iter_particion(self, particion, valor, desde=None, hasta=None, chunk_size=CHUNK_SIZE):
+        '''Iterate over the registers of a group of PARTICIONES, as returned by
+            get_resumen_registros for that grouping, optionally from (and up to) a
+            fecha_entrada. Each partition is read through its own index range
+        '''
+        if particion not in PARTICIONES:
+            raise ValueError(f"Partición no permitida: {particion}")
+        clave = AGRUPACIONES[particion][2]
+        if valor is None:
+            # The registers whose group is NULL form their own group, selected with
+            # the same expression as in get_resumen_registros, so it also has the
+            # dates that aren't in ISO format
+            condicion, valores = f"{clave} IS NULL", ()
+        elif particion == "mes":
+            # The month mm-yyyy becomes a range of ISO dates, without the values
+            # in the range that aren't valid dates, which are in the NULL group
+            mes, anio = map(int, valor.split("-"))
+            siguiente = date(anio + mes // 12, mes % 12 + 1, 1)
+            condicion, valores = f"fechaEntrada >= ? AND fechaEntrada < ? AND {clave} IS NOT NULL", (
+                f"{anio:04d}-{mes:02d}-01", siguiente.isoformat())
+        else:
+            condicion, valores = "operador = ?", (valor,)
+        where, params = self._filtro_fecha_entrada(desde, hasta, condicion, valores)
+        return self._iterar(f"SELECT {COLUMNAS_REGISTROS} FROM registros{where}", params, chunk_size)
+
+    def iter_cambios(self, despues, hasta, chunk_size=CHUNK_SIZE):
+        '''Iterate over the registers added or modified after the mark despues and
+            up to the mark hasta, both (id, modificado) pairs as returned by
+            get_marca_registros. New registers are read by id and modified ones by
+            the index of modificado, so the cost follows the number of changes
+        '''
+        return self._iterar(
+            f"SELECT {COLUMNAS_REGISTROS} FROM registros WHERE id > ?1 AND id <= ?3 \
+            UNION ALL \
+            SELECT {COLUMNAS_REGISTROS} FROM registros \
+                WHERE modificado > ?2 AND modificado <= ?4 AND id <= ?1",
+            (*despues, *hasta), chunk_size)
+
+    def _iterar(self, query, params, chunk_size):
+        '''Iterate over the rows of a query, fetching them in chunks'''
+        with self.pool.lector() as conn:
+            cur = conn.execute(query, params)
+            try:
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield from rows
+            finally:
+                cur.close()
+
+    def get_marca_registros(self):
+        '''Current high-water mark of the registers: their last id and their last
+            modification, to export later only what changes after it
+        '''
+        with self.pool.lector() as conn:
+            # Each maximum is read from the end of its index. The partial index of
+            # modificado can only be used with the condition it was created with
+            id, modificado = conn.execute(
+                "SELECT (SELECT MAX(id) FROM registros), \
+                    (SELECT MAX(modificado) FROM registros WHERE modificado IS NOT NULL)").fetchone()
+        return (id or 0, modificado or "")
+
+    def get_marca_exportacion(self):
+        '''High-water mark of the registers at the last export'''
+        id, modificado = (self.get_metadato(clave) for clave in MARCA_EXPORTACION)
+        return (id or 0, modificado or "")
+
+    def set_marca_exportacion(self, marca):
+        '''Store the high-water mark of the registers exported'''
+        self.set_metadatos(dict(zip(MARCA_EXPORTACION, marca)))
+
+    def get_pagina_registros(self, orden="id", despues=None, antes=None, limite=TAM_PAGINA):
+        '''Read a page of registers sorted by orden and id, right after or before the
+            key of a register: the value of orden and its id. Instead of an OFFSET,
+            the index of orden leads straight to the first row of the page, so any
+            page costs the same. Every row ends with the value of orden, and rows
+            where it is NULL are left out
+        '''
+        if orden not in ORDENES:
+            raise ValueError(f"No se puede ordenar por {orden}")
+        columnas = f"{COLUMNAS_REGISTROS}, {orden} AS clave"
+        if despues is None and antes is None:
+            query = f"SELECT {columnas} FROM registros WHERE {orden} IS NOT NULL \
+                ORDER BY {orden}, id LIMIT ?"
+            params = (limite,)
+        elif orden == "id":
+            signo, sentido = (">", "ASC") if antes is None else ("<", "DESC")
+            query = f"SELECT {columnas} FROM registros WHERE id {signo} ? ORDER BY id {sentido} LIMIT ?"
+            params = ((despues or antes)[1], limite)
+        else:
+            # The rows with the same value of orden and the ones with the next values
+            # are read separately, so each part is a seek on the index
+            signo, sentido = (">", "ASC") if antes is None else ("<", "DESC")
+            query = f"SELECT * FROM ( \
+                SELECT * FROM (SELECT {columnas} FROM registros \
+                    WHERE {orden} = ?1 AND id {signo} ?2 ORDER BY id {sentido} LIMIT ?3) \
+                UNION ALL \
+                SELECT * FROM (SELECT {columnas} FROM registros \
+                    WHERE {orden} {signo} ?1 ORDER BY {orden} {sentido}, id {sentido} LIMIT ?3)) \
+                ORDER BY clave {sentido}, 1 {sentido} LIMIT ?3"
+            params = (*(despues or antes), limite)
+        with self.pool.lector() as conn:
+            rows = conn.execute(query, params).fetchall()
+        # Pages before a key are read backwards
+        if antes is not None:
+            rows.reverse()
+        return rows
+
+    def get_resumen_registros(self, agrupacion, desde=None, hasta=None):
+        '''Count the registers and add up their importe by one of the AGRUPACIONES,
+            optionally from (and up to) a fecha_entrada. Returns one row per group:
+            group, registers, importe
+        '''
+        columna, grupo, clave = self._agrupacion(agrupacion)
+        where, params = self._filtro_fecha_entrada(desde, hasta)
+        # The registers are first aggregated by the indexed column, reading only its
+        # covering index, and the few resulting rows are then grouped again
+        with self.pool.lector() as conn:
+            return conn.execute(
+                f"SELECT {grupo}, SUM(registros), ROUND(SUM(importe), 2) FROM ( \
+                    SELECT {columna}, COUNT(*) AS registros, TOTAL(importe) AS importe \
+                        FROM registros{where} GROUP BY {columna}) \
+                GROUP BY {clave} ORDER BY {clave}", params).fetchall()
+
+    def get_resumen_incidencias(self, agrupacion, desde=None, hasta=None):
+        '''Statistics of num_llamadas of the INCIDENCIA registers by one of the
+            AGRUPACIONES, optionally from (and up to) a fecha_entrada. Returns one row
+            per group: group, incidencias, calls, average, minimum and maximum calls
+        '''
+        columna, grupo, clave = self._agrupacion(agrupacion)
+        where, params = self._filtro_fecha_entrada(desde, hasta, "estado = 'INCIDENCIA'")
+        # The partial index of the incidencias covers every column read here
+        with self.pool.lector() as conn:
+            return conn.execute(
+                f"SELECT {grupo}, SUM(incidencias), CAST(SUM(llamadas) AS INTEGER), \
+                    ROUND(SUM(llamadas) / SUM(con_llamadas), 2), MIN(minimo), MAX(maximo) FROM ( \
+                    SELECT {columna}, COUNT(*) AS incidencias, TOTAL(num_llamadas) AS llamadas, \
+                        COUNT(num_llamadas) AS con_llamadas, MIN(num_llamadas) AS minimo, \
+                        MAX(num_llamadas) AS maximo \
+                        FROM registros INDEXED BY idx_registros_incidencias{where} \
+                        GROUP BY {columna}) \
+                GROUP BY {clave} ORDER BY {clave}", params).fetchall()
+
+    def _agrupacion(self, agrupacion):
+        '''Column, shown expression and grouping expression of one of the AGRUPACIONES'''
+        if agrupacion not in AGRUPACIONES:
+            raise ValueError(f"No se puede agrupar por {agrupacion}")
+        return AGRUPACIONES[agrupacion]
+
+    def _filtro_fecha_entrada(self, desde, hasta, condicion=None, valores=()):
+        '''WHERE clause and parameters to filter the registers by fecha_entrada,
+            and optionally by another condition with its own parameters
+        '''
+        condiciones = [condicion] if condicion else []
+        params = tuple(valores)
+        if desde is not None and hasta is not None:
+            condiciones.append("fechaEntrada BETWEEN ? AND ?")
+            params += (fecha_iso(desde), fecha_iso(hasta))
+        elif desde is not None:
+            condiciones.append("fechaEntrada >= ?")
+            params += (fecha_iso(desde),)
+        if not condiciones:
+            return "", ()
+        return " WHERE " + " AND ".join(condiciones), params
+
     def insert_registro(self, values=[]):
-        '''Insert a new register, passing the values as an array'''
-        list = np.array(values).tolist()
-        self.cur.execute(
-            "INSERT INTO registros VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (list))
-        self.conn.commit()
+        '''Insert a new register, passing a Registro or the values as an array'''
+        with self.transaction() as conn:
+            conn.execute(INSERTAR_REGISTRO, parametros_registro(values))
+
+    def upsert_registros(self, values):
+        '''Insert registers or, when their identificador already exists, update
+            them, all in a single transaction. values is a list of Registro or of
+            lists of values. Returns the number of registers inserted and updated
+        '''
+        with self.transaction() as conn:
+            return self._upsert(conn, values)
+
+    def upsert_registro(self, values):
+        '''Insert a register or update the one with its identificador. Returns
+            whether it was inserted
+        '''
+        insertadas, _ = self.upsert_registros([values])
+        return insertadas == 1
+
+    def _upsert(self, conn, values):
+        '''Upsert registers on the writer connection. Each new register takes the
+            next id while the writer is held, so the ones inserted are the growth
+            of the highest id and the rest were updated
+        '''
+        ultimo = conn.execute("SELECT MAX(id) FROM registros").fetchone()[0] or 0
+        cur = conn.executemany(UPSERT_REGISTRO, map(parametros_registro, values))
+        procesadas = cur.rowcount
+        insertadas = (conn.execute("SELECT MAX(id) FROM registros").fetchone()[0] or 0) - ultimo
+        return insertadas, procesadas - insertadas
 
     def insert_multiples_registros(self, values=[]):
         '''Insert multiple new registers'''
-        list = np.array(values).tolist()
-        self.cur.executemany(
-            "INSERT INTO registros VALUES (NULL, ?)",
-            (list))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.executemany(INSERTAR_REGISTRO, map(parametros_registro, values))
     
     def edit_registro(self, values=[]):
-        '''Edit a register'''
-        list = np.array(values).tolist()
-        self.cur.execute(
-            "UPDATE registros SET fechaEntrada = ? \
-                WHERE id = ?",
-            (list))
-        self.conn.commit()
+        '''Edit a register, passing its new fechaEntrada and its id'''
+        with self.transaction() as conn:
+            conn.execute("UPDATE registros SET fechaEntrada = ? WHERE id = ?",
+                         (fecha_iso(values[0]), values[1]))
 
     def delete_registro(self, id):
         '''Delete a register'''
-        self.cur.execute("DELETE FROM registros WHERE id = ?", (id,))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM registros WHERE id = ?", (id,))
+
+
+    ############################################################################
+    def get_filas_importadas(self, archivo):
+        '''Read how many rows of a file were committed by an interrupted import'''
+        with self.pool.lector() as conn:
+            row = conn.execute("SELECT filas FROM importaciones WHERE archivo = ?", (archivo,)).fetchone()
+        return row[0] if row else 0
+
+    def merge_lote_registros(self, values, archivo, filas, primera_fila=2, actualizar=True):
+        '''Merge a batch of imported registers into registros and record the import
+            progress of the file, in a single transaction. The batch is bulk-loaded
+            into a staging table and classified with a few set-based statements:
+            rows whose identificador already appeared in the file are duplicates
+            and skipped, rows equal to their existing register are left as they
+            are, so importing a file again writes nothing, and rows that differ
+            from it are conflicts, which update it if actualizar. The rest are
+            inserted. primera_fila is the row of the file of the first register.
+            Returns a ResultadoFusion
+        '''
+        iguales = " AND ".join(f"r.{campo} IS s.{campo}" for campo in CAMPOS_FUSION)
+        # Converted before the transaction, so a wrong value doesn't fail it halfway
+        filas_staging = [(fila, *parametros_registro(registro))
+                         for fila, registro in enumerate(values, primera_fila)]
+        with self.transaction() as conn:
+            # executescript would commit the open transaction, so they are created one by one
+            if not self._staging(conn):
+                for tabla in TABLAS_STAGING:
+                    conn.execute(tabla)
+            conn.execute("DELETE FROM staging_registros")
+            conn.executemany(INSERTAR_STAGING, filas_staging)
+
+            # Duplicates of a previous batch of the file and of an earlier row of this one
+            conn.execute(
+                "UPDATE staging_registros AS s SET tipo = 'duplicado', coincidencia = ( \
+                    SELECT fila FROM importaciones_vistos v WHERE v.archivo = ? AND v.identificador = s.identificador) \
+                WHERE identificador IN (SELECT identificador FROM importaciones_vistos WHERE archivo = ?)",
+                (archivo, archivo))
+            conn.execute(
+                "UPDATE staging_registros AS s SET tipo = 'duplicado', coincidencia = ( \
+                    SELECT MIN(fila) FROM staging_registros p WHERE p.identificador = s.identificador) \
+                WHERE tipo IS NULL AND fila > ( \
+                    SELECT MIN(fila) FROM staging_registros p WHERE p.identificador = s.identificador)")
+            conn.execute(
+                "INSERT OR IGNORE INTO importaciones_vistos \
+                SELECT ?, identificador, fila FROM staging_registros WHERE tipo IS NULL", (archivo,))
+
+            # Registers that already exist, unchanged or with different values
+            conn.execute(
+                f"UPDATE staging_registros AS s SET \
+                    coincidencia = (SELECT id FROM registros r WHERE r.identificador = s.identificador), \
+                    tipo = CASE WHEN EXISTS (SELECT 1 FROM registros r \
+                        WHERE r.identificador = s.identificador AND {iguales}) THEN 'identico' \
+                        ELSE 'conflicto' END \
+                WHERE tipo IS NULL AND identificador IN (SELECT identificador FROM registros)")
+            diferentes = ", ".join(f"r.{campo} IS NOT s.{campo}" for campo in CAMPOS_FUSION)
+            conflictos = [
+                (fila, identificador, id, [campo for campo, cambia in zip(CAMPOS_FUSION, cambios) if cambia])
+                for fila, identificador, id, *cambios in conn.execute(
+                    f"SELECT s.fila, s.identificador, r.id, {diferentes} \
+                    FROM staging_registros s JOIN registros r ON r.id = s.coincidencia \
+                    WHERE s.tipo = 'conflicto' ORDER BY s.fila")]
+            duplicados = conn.execute(
+                "SELECT fila, identificador, coincidencia FROM staging_registros \
+                WHERE tipo = 'duplicado' ORDER BY fila").fetchall()
+
+            # Only the conflicts and the new registers are written
+            actualizadas = 0
+            if actualizar and conflictos:
+                actualizadas = conn.execute(
+                    f"UPDATE registros SET ({', '.join(CAMPOS_FUSION)}) = ( \
+                        SELECT {', '.join(CAMPOS_FUSION)} FROM staging_registros s \
+                        WHERE s.coincidencia = registros.id AND s.tipo = 'conflicto') \
+                    WHERE id IN (SELECT coincidencia FROM staging_registros WHERE tipo = 'conflicto')"
+                ).rowcount
+            insertadas = conn.execute(
+                f"INSERT INTO registros ({', '.join(CAMPOS_REGISTROS[1:])}) \
+                SELECT {', '.join(CAMPOS_REGISTROS[1:])} FROM staging_registros \
+                WHERE tipo IS NULL ORDER BY fila").rowcount
+            identicas = conn.execute(
+                "SELECT COUNT(*) FROM staging_registros WHERE tipo = 'identico'").fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO importaciones VALUES (?, ?, datetime('now'))",
+                (archivo, filas))
+        return ResultadoFusion(insertadas, actualizadas, identicas, duplicados, conflictos)
+
+    def _staging(self, conn):
+        '''Whether the staging tables already exist in a connection'''
+        return conn.execute(
+            "SELECT 1 FROM temp.sqlite_master WHERE name = 'staging_registros'").fetchone() is not None
+
+    def delete_importacion(self, archivo):
+        '''Forget the progress of a file once its import is finished or discarded,
+            together with the identificadores of the file seen while merging it
+        '''
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM importaciones WHERE archivo = ?", (archivo,))
+            conn.execute("DELETE FROM importaciones_vistos WHERE archivo = ?", (archivo,))
 
 
-    ############################################################################
\ No newline at end of file
+    ############################################################################
+    def insert_logs(self, eventos):
+        '''Insert several events of the audit trail, (fecha, usuario, accion), in a
+            single transaction
+        '''
+        with self.transaction() as conn:
+            conn.executemany("INSERT INTO logs (fecha, usuario, accion) VALUES (?, ?, ?)", eventos)
+
+    def get_logs(self, usuario=None, desde=None, hasta=None, limite=TAM_PAGINA):
+        '''Read the latest events of the audit trail, optionally of a user and from
+            (and up to, both included) a date
+        '''
+        condiciones = []
+        params = []
+        if usuario is not None:
+            condiciones.append("usuario = ?")
+            params.append(usuario)
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            params.append(fecha_iso(desde))
+        if hasta is not None:
+            condiciones.append("fecha < date(?, '+1 day')")
+            params.append(fecha_iso(hasta))
+        where = " WHERE " + " AND ".join(condiciones) if condiciones else ""
+        with self.pool.lector() as conn:
+            return conn.execute(f"SELECT fecha, usuario, accion FROM logs{where} \
+                ORDER BY fecha DESC LIMIT ?", (*params, limite)).fetchall()
+
+
+    ############################################################################
+    def get_metadato(self, clave, defecto=None):
+        '''Read a value of the metadatos table'''
+        with self.pool.lector() as conn:
+            row = conn.execute("SELECT valor FROM metadatos WHERE clave = ?", (clave,)).fetchone()
+        return row[0] if row else defecto
+
+    def set_metadatos(self, valores):
+        '''Store several values of the metadatos table in a single transaction'''
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO metadatos VALUES (?, ?)", valores.items())
+
+
+    ############################################################################
+    def backup(self, destino, paginas=PAGINAS_COPIA, pausa=PAUSA_COPIA, progreso=None):
+        '''Copy the database to the file destino while it's in use, with the online
+            backup API of SQLite. The source is the writer connection, so the
+            changes written through it during the copy are copied too instead of
+            restarting it, and it's only held while a step of paginas pages is
+            copied: between two steps it's released for pausa seconds.
+            progreso(copiadas, total) is called after every step and can stop the
+            copy by raising an exception. Returns the number of pages copied
+        '''
+        def paso(estado, restantes, total):
+            if progreso is not None:
+                progreso(total - restantes, total)
+            if restantes:
+                self.pool.ceder_escritor(pausa)
+
+        copia = sqlite3.connect(destino)
+        try:
+            with self.pool.escritor() as conn:
+                conn.backup(copia, pages=paginas, progress=paso)
+            # The copy is a single file, whatever the journal mode of the source
+            copia.execute("PRAGMA journal_mode = DELETE")
+            return copia.execute("PRAGMA page_count").fetchone()[0]
+        finally:
+            copia.close()
+
+    def vacuum_into(self, destino, progreso=None):
+        '''Write a compacted copy of the database to the file destino, which
+            mustn't exist, with VACUUM INTO. It reads from a reader connection, so in
+            WAL mode it doesn't block the writes. progreso(0, None) is called
+            every INSTRUCCIONES_PROGRESO instructions and can stop the copy by
+            raising an exception
+        '''
+        error = []
+        def paso():
+            try:
+                progreso(0, None)
+            except Exception as excepcion:
+                error.append(excepcion)
+                return 1
+            return 0
+
+        with self.pool.lector() as conn:
+            if progreso is not None:
+                conn.set_progress_handler(paso, INSTRUCCIONES_PROGRESO)
+            try:
+                conn.execute("VACUUM INTO ?", (str(destino),))
+            except sqlite3.OperationalError:
+                if error:
+                    raise error[0] from None
+                raise
+            finally:
+                conn.set_progress_handler(None, 0)
@@ -5,56 +5,265 @@ Description: This file contains the Excel class, which is used to handle excel f
 Date: 2023-06-30
 '''
 
+import os
+import re
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
+from itertools import islice
 from openpyxl import Workbook
 from openpyxl import load_workbook
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename, askdirectory
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+
+# Número máximo de filas de una hoja de Excel
+MAX_FILAS_HOJA = 1048576
+
+# Nombres de los estilos registrados en cada libro
+ESTILO_CABECERA = 'Cabecera'
+ESTILO_CUERPO = 'Cuerpo'
+
+# Ancho por defecto de las columnas
+ANCHO_COLUMNA = 20
+
+# Partes y espacios de nombres de un xlsx que hay que modificar para añadirle hojas
+LIBRO = "xl/workbook.xml"
+RELACIONES_LIBRO = "xl/_rels/workbook.xml.rels"
+TIPOS = "[Content_Types].xml"
+ESTILOS = "xl/styles.xml"
+NS_LIBRO = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_RELACION = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PAQUETE = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+TIPO_HOJA = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+# Atributos de estilo de las filas, columnas y celdas de una hoja
+ATRIBUTO_ESTILO = re.compile(rb'(<(?:\w+:)?(?:c|row|col) [^>]*?) (?:s|style)="\d+"')
+
+def anadir_hojas(destino, origen):
+    """ Añade al libro destino las hojas del libro origen sin cargar las celdas de
+        ninguno de los dos: las hojas de origen se copian tal cual al zip de
+        destino y solo se reescriben el índice de hojas, sus relaciones y los
+        tipos de contenido. Las hojas de origen no pueden usar cadenas compartidas,
+        como las de solo escritura de openpyxl, y conservan sus estilos si los dos
+        libros tienen los mismos. Se trabaja sobre una copia de destino, que lo
+        sustituye al terminar. Devuelve los nombres de las hojas añadidas """
+    temporal = f"{destino}.parcial"
+    shutil.copyfile(destino, temporal)
+    try:
+        with zipfile.ZipFile(origen) as libro_origen, zipfile.ZipFile(temporal, "a") as libro:
+            hojas = _hojas_libro(libro_origen)
+            mismos_estilos = libro_origen.read(ESTILOS) == libro.read(ESTILOS)
+            libro_xml = libro.read(LIBRO)
+            relaciones_xml = libro.read(RELACIONES_LIBRO)
+            tipos_xml = libro.read(TIPOS)
+            existentes = list(ET.fromstring(libro_xml).iter(f"{NS_LIBRO}sheet"))
+            nombres = {hoja.get("name").lower() for hoja in existentes}
+            siguiente_id = max([int(hoja.get("sheetId")) for hoja in existentes] + [0]) + 1
+            relaciones = {relacion.get("Id") for relacion
+                          in ET.fromstring(relaciones_xml).iter(f"{NS_PAQUETE}Relationship")}
+            partes = re.findall(r"^xl/worksheets/sheet(\d+)\.xml$", "\n".join(libro.namelist()), re.M)
+            numero = max([int(parte) for parte in partes] + [0]) + 1
+
+            nuevas = []
+            for nombre, parte in hojas:
+                titulo = nombre
+                copia = 1
+                while titulo.lower() in nombres:
+                    copia += 1
+                    titulo = f"{nombre[:26]} ({copia})"
+                nombres.add(titulo.lower())
+                hoja_xml = libro_origen.read(parte)
+                if not mismos_estilos:
+                    hoja_xml = ATRIBUTO_ESTILO.sub(rb"\1", hoja_xml)
+                id_relacion = f"rIdHoja{numero}"
+                while id_relacion in relaciones:
+                    id_relacion += "x"
+                libro.writestr(f"xl/worksheets/sheet{numero}.xml", hoja_xml, zipfile.ZIP_DEFLATED)
+                libro_xml = _insertar(libro_xml, "sheets",
+                    f'<{{p}}sheet xmlns:rel="{NS_RELACION}" name="{_escapar(titulo)}" '
+                    f'sheetId="{siguiente_id}" rel:id="{id_relacion}"/>')
+                relaciones_xml = _insertar(relaciones_xml, "Relationships",
+                    f'<{{p}}Relationship Id="{id_relacion}" Type="{NS_RELACION}/worksheet" '
+                    f'Target="/xl/worksheets/sheet{numero}.xml"/>')
+                tipos_xml = _insertar(tipos_xml, "Types",
+                    f'<{{p}}Override PartName="/xl/worksheets/sheet{numero}.xml" ContentType="{TIPO_HOJA}"/>')
+                nuevas.append(titulo)
+                siguiente_id += 1
+                numero += 1
+
+            # Las partes reescritas sustituyen a las anteriores en el índice del zip;
+            # los datos antiguos quedan sin referenciar
+            for parte, contenido in ((LIBRO, libro_xml), (RELACIONES_LIBRO, relaciones_xml),
+                                     (TIPOS, tipos_xml)):
+                anterior = libro.NameToInfo.pop(parte)
+                libro.filelist.remove(anterior)
+                libro.writestr(parte, contenido, zipfile.ZIP_DEFLATED)
+        os.replace(temporal, destino)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return nuevas
+
+def _hojas_libro(libro):
+    """ Nombres y partes del zip de las hojas de un libro, en orden """
+    relaciones = {relacion.get("Id"): relacion.get("Target") for relacion
+                  in ET.fromstring(libro.read(RELACIONES_LIBRO)).iter(f"{NS_PAQUETE}Relationship")}
+    hojas = []
+    for hoja in ET.fromstring(libro.read(LIBRO)).iter(f"{NS_LIBRO}sheet"):
+        destino = relaciones[hoja.get(f"{{{NS_RELACION}}}id")]
+        parte = destino.lstrip("/") if destino.startswith("/") else f"xl/{destino}"
+        hojas.append((hoja.get("name"), parte))
+    return hojas
+
+def _insertar(xml, elemento, fragmento):
+    """ Inserta un fragmento antes del cierre de un elemento, con su mismo prefijo """
+    cierre = re.search(rb"</((?:[\w.-]+:)?)" + elemento.encode() + rb">", xml)
+    prefijo = cierre.group(1).decode()
+    return xml[:cierre.start()] + fragmento.format(p=prefijo).encode("utf-8") + xml[cierre.start():]
+
+def _escapar(texto):
+    """ Escapa un texto para usarlo como valor de un atributo XML """
+    return texto.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+
+def estilo_cabecera():
+    """ Crea el estilo con nombre de las celdas de cabecera """
+    estilo = NamedStyle(name=ESTILO_CABECERA)
+    estilo.alignment = Alignment(horizontal='center', vertical='center')
+    borde = Side(style='thick')
+    estilo.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+    estilo.font = Font(name='Gotham Bold', size=12)
+    return estilo
+
+def estilo_cuerpo():
+    """ Crea el estilo con nombre de las celdas de datos """
+    estilo = NamedStyle(name=ESTILO_CUERPO)
+    estilo.alignment = Alignment(horizontal='center', vertical='center')
+    borde = Side(style='thin')
+    estilo.border = Border(left=borde, right=borde, top=borde, bottom=borde)
+    estilo.font = Font(name='Gotham Light', size=10)
+    return estilo
+
+class Vista:
+    """ Vista perezosa de las filas o columnas de la hoja activa de un Excel. No
+        guarda ninguna copia: cada vez que se recorre, lo hace directamente sobre
+        la hoja, por lo que siempre está al día """
+    def __init__(self, excel, recorrer, longitud):
+        """ Constructor. recorrer y longitud reciben la hoja y devuelven sus
+            elementos y su número """
+        self._excel = excel
+        self._recorrer = recorrer
+        self._longitud = longitud
+
+    def __iter__(self):
+        if not self._excel.hoja:
+            return iter(())
+        return self._recorrer(self._excel.hoja)
+
+    def __len__(self):
+        if not self._excel.hoja:
+            return 0
+        longitud = self._longitud(self._excel.hoja)
+        # Las hojas de solo lectura sin dimensiones guardadas hay que contarlas
+        return longitud if longitud is not None else sum(1 for _ in self)
+
+    def __bool__(self):
+        return next(iter(self), None) is not None
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return list(self)[indice]
+        if indice < 0:
+            indice += len(self)
+        elemento = next(islice(self, indice, None), None) if indice >= 0 else None
+        if elemento is None:
+            raise IndexError("Índice fuera de la hoja")
+        return elemento
+
 
 class Excel:
-    """ Clase para manejar archivos excel """
+    """ Clase para manejar archivos excel. celdas, datos, columnas y filas son
+        vistas de la hoja activa que se calculan al recorrerlas """
     def __init__(self):
         """ Constructor """
         self.archivo = ''
         self.libro = ''
         self.hoja = ''
-        self.celdas = []
-        self.datos = []
-        self.columnas = []
-        self.filas = []
+        self.celdas = Vista(self, iter, lambda hoja: hoja.max_row)
+        self.datos = Vista(self, lambda hoja: hoja.iter_rows(values_only=True), lambda hoja: hoja.max_row)
+        self.columnas = Vista(self, lambda hoja: hoja.iter_cols(), lambda hoja: hoja.max_column)
+        self.filas = Vista(self, lambda hoja: hoja.iter_rows(), lambda hoja: hoja.max_row)
 
     def crear_archivo(self, nombre):
         """ Crea un archivo excel """
         self.libro = Workbook()
+        self.registrar_estilos()
         self.archivo = nombre
         self.hoja = self.libro.active
         self.hoja.title = 'Registros'
-        self.celdas = list(self.hoja)
-        self.datos = list(self.hoja.values)
-        self.columnas = list(self.hoja.columns)
-        self.filas = list(self.hoja.rows)
     
+    def crear_archivo_streaming(self, nombre):
+        """ Crea un archivo excel de solo escritura, en el que las filas se vuelcan
+            directamente al disco sin mantenerse en memoria """
+        self.libro = Workbook(write_only=True)
+        self.registrar_estilos()
+        self.archivo = nombre
+        self.hoja = ''
+
+    def registrar_estilos(self):
+        """ Registra una sola vez en el libro los estilos de cabecera y de datos,
+            que las celdas comparten en lugar de crear sus propios estilos """
+        for estilo in (estilo_cabecera(), estilo_cuerpo()):
+            if estilo.name not in self.libro.named_styles:
+                self.libro.add_named_style(estilo)
+
+    def celda_con_estilo(self, estilo, valor=None):
+        """ Crea una celda de solo escritura con un estilo registrado """
+        celda = WriteOnlyCell(self.hoja, value=valor)
+        celda.style = estilo
+        return celda
+
+    def fijar_ancho_columnas(self, num_columnas, ancho=ANCHO_COLUMNA):
+        """ Fija el ancho de las columnas a partir del número de cabeceras """
+        for i in range(num_columnas):
+            self.hoja.column_dimensions[get_column_letter(i+1)].width = ancho
+
     def actualizar_hoja(self):
-        """ Actualiza la hoja """
-        self.celdas = list(self.hoja)
-        self.datos = list(self.hoja.values)
-        self.columnas = list(self.hoja.columns)
-        self.filas = list(self.hoja.rows)
-
-    def cargar_archivo(self):
-        """ Carga el archivo excel """
-        Tk().withdraw()
-        self.archivo = askopenfilename()
-        if self.archivo != '':
-            self.libro = load_workbook(self.archivo)
-            self.hoja = self.libro.active
-            self.celdas = list(self.hoja)
-            self.datos = list(self.hoja.values)
-            self.columnas = list(self.hoja.columns)
-            self.filas = list(self.hoja.rows)
-            return True
-        else:
+        """ Actualiza la hoja. Las vistas se calculan al recorrerlas, así que ya
+            están siempre al día """
+
+    def cargar_archivo(self, archivo='', solo_lectura=False):
+        """ Carga el archivo excel indicado o, si no se indica, el elegido en un
+            diálogo. Tkinter solo se importa aquí, para poder usar el resto de la
+            clase sin pantalla. En modo de solo lectura las filas se leen del disco
+            a medida que se recorren, pero la hoja no tiene columnas ni se puede
+            modificar """
+        if archivo == '':
+            from tkinter import Tk
+            from tkinter.filedialog import askopenfilename
+            Tk().withdraw()
+            archivo = askopenfilename()
+        if archivo == '':
             return False
+        if solo_lectura:
+            self.cargar_archivo_lectura(archivo)
+        else:
+            self.archivo = archivo
+            self.libro = load_workbook(archivo)
+            self.hoja = self.libro.active
+        return True
+
+    def cargar_archivo_lectura(self, archivo):
+        """ Carga el archivo excel en modo de solo lectura, que lee las filas del
+            disco a medida que se recorren en lugar de cargar el libro entero """
+        self.archivo = archivo
+        self.libro = load_workbook(archivo, read_only=True, data_only=True)
+        self.hoja = self.libro.active
+
+    def leer_filas(self, desde=1):
+        """ Recorre los valores de las filas de la hoja a partir de una fila dada """
+        return self.hoja.iter_rows(min_row=desde, values_only=True)
 
     def guardar_archivo_como(self, nombre=''):
         """ Guarda el archivo excel """
@@ -64,27 +273,15 @@ class Excel:
         """ Cierra el archivo excel """
         self.libro.close()
         self.hoja = ''
-        self.celdas = []
-        self.datos = []
-        self.columnas = []
-        self.filas = []
         self.archivo = ''
     
     def crear_hoja(self, nombre):
         """ Crea una hoja en el archivo """
         self.hoja = self.libro.create_sheet(nombre)
-        self.celdas = list(self.hoja)
-        self.datos = list(self.hoja.values)
-        self.columnas = list(self.hoja.columns)
-        self.filas = list(self.hoja.rows)
     
     def seleccionar_hoja(self, nombre):
         """ Selecciona una hoja del archivo """
         self.hoja = self.libro[nombre]
-        self.celdas = list(self.hoja)
-        self.datos = list(self.hoja.values)
-        self.columnas = list(self.hoja.columns)
-        self.filas = list(self.hoja.rows)
 
     def rellenar_cabeceras(self, cabeceras):
         """ Rellena la primera fila con las cabeceras """
@@ -95,29 +292,57 @@ class Excel:
         """ Rellena la hoja con los registros """
         for registro in registros:
             self.hoja.append(registro)
-        self.actualizar_hoja()
     
+    def rellenar_hoja_streaming(self, cabeceras, registros, nombre='Registros',
+                                progreso=None, cada=1000):
+        """ Vuelca los registros en hojas de solo escritura, continuando en una hoja
+            nueva cada vez que se alcanza el límite de filas. Si se indica, progreso
+            recibe el número de registros escritos cada cierto número de filas.
+            Devuelve el número de registros escritos """
+        total = 0
+        hojas = 0
+        filas = MAX_FILAS_HOJA
+        plantilla = []
+        for registro in registros:
+            if filas == MAX_FILAS_HOJA:
+                hojas += 1
+                self.crear_hoja_streaming(nombre if hojas == 1 else f"{nombre} {hojas}", cabeceras)
+                plantilla = [self.celda_con_estilo(ESTILO_CUERPO) for _ in cabeceras]
+                filas = 1
+            # Las celdas ya formateadas se reutilizan: solo cambia su valor
+            for i, valor in enumerate(registro):
+                if i == len(plantilla):
+                    plantilla.append(self.celda_con_estilo(ESTILO_CUERPO))
+                plantilla[i].value = valor
+            for celda in plantilla[len(registro):]:
+                celda.value = None
+            self.hoja.append(plantilla)
+            filas += 1
+            total += 1
+            if progreso is not None and total % cada == 0:
+                progreso(total)
+        # Un archivo sin registros conserva al menos la hoja con las cabeceras
+        if hojas == 0:
+            self.crear_hoja_streaming(nombre, cabeceras)
+        return total
+
+    def crear_hoja_streaming(self, nombre, cabeceras):
+        """ Crea una hoja de solo escritura con las cabeceras ya formateadas """
+        self.hoja = self.libro.create_sheet(nombre)
+        # El ancho de las columnas debe fijarse antes de escribir la primera fila
+        self.fijar_ancho_columnas(len(cabeceras))
+        self.hoja.append([self.celda_con_estilo(ESTILO_CABECERA, cabecera) for cabecera in cabeceras])
+
     def formato_hoja(self):
         """ Formatea la hoja """
-        for fila in self.filas[1:]:
+        self.registrar_estilos()
+        for fila in self.hoja.iter_rows(min_row=2):
             for celda in fila:
-                celda.alignment = Alignment(horizontal='center', vertical='center')
-                celda.border = Border(
-                    left = Side(style='thin'), 
-                    right = Side(style='thin'), 
-                    top = Side(style='thin'), 
-                    bottom = Side(style='thin'))
-                celda.font = Font(name='Gotham Light', size=10)
-        for columna in self.columnas:
-            self.hoja.column_dimensions[columna[0].column_letter].width = 20
+                celda.style = ESTILO_CUERPO
+        self.fijar_ancho_columnas(self.hoja.max_column)
     
     def formato_cabecera(self):
         """ Formatea la cabecera """
-        for celda in self.celdas[0]:
-            celda.alignment = Alignment(horizontal='center', vertical='center')
-            celda.border = Border(
-                left=Side(style='thick'), 
-                right=Side(style='thick'), 
-                top=Side(style='thick'), 
-                bottom=Side(style='thick'))
-            celda.font = Font(name='Gotham Bold', size=12)
\ No newline at end of file
+        self.registrar_estilos()
+        for celda in self.hoja[1]:
+            celda.style = ESTILO_CABECERA
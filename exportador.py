@@ -0,0 +1,241 @@
+'''Streaming export of the registers to Excel
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the functions used to export the registers from
+    the database to Excel files. Rows are pulled from a database cursor in chunks
+    and written to a write-only workbook, so memory usage stays flat regardless
+    of the number of registers. After a full export, the changes can be exported
+    incrementally: only the registers added or modified since the last export.
+    Large exports can be split by month or operador into one file per group,
+    written in parallel by a pool of processes.
+    The time spent reading, writing and saving is logged for every export.
+Date: 2023-06-30
+'''
+
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing import get_context
+from db import Database
+from excel import Excel, anadir_hojas
+from instrumentacion import Fases
+
+logger = logging.getLogger("exportador")
+
+# Name of the index file of a partitioned export
+INDICE = "Índice.xlsx"
+
+# Headers of the index of a partitioned export, after the one of the grouping
+CABECERAS_INDICE = ["Archivo", "Registros", "Importe"]
+
+
+def exportar_registros(database, nombre, cabeceras, desde=None, hasta=None, progreso=None):
+    '''Export the registers, optionally filtered by fecha_entrada, to an Excel file.
+        progreso receives the number of registers exported and the total.
+        Returns the number of exported registers
+    '''
+    # Count the registers to export, so the progress can be reported
+    registros = database.count_registros(desde, hasta) if progreso is not None else None
+
+    # A full export is the starting point of the incremental ones
+    marca = database.get_marca_registros() if desde is None and hasta is None else None
+
+    # Create a new write-only Excel file
+    fases = Fases(f"Exportación {nombre}")
+    excel = Excel()
+    excel.crear_archivo_streaming(nombre)
+    filas = database.iter_registros(desde, hasta)
+    try:
+        # Stream the data from the database to the Excel file. The time spent
+        # pulling the rows counts as reading, and the rest as writing
+        with fases.fase("escritura"):
+            total = excel.rellenar_hoja_streaming(
+                cabeceras, fases.iterar("lectura", filas),
+                progreso=None if progreso is None else lambda hechos: progreso(hechos, registros))
+
+        # Save the Excel file
+        with fases.fase("guardado"):
+            excel.guardar_archivo_como()
+    finally:
+        # Give the reader connection back even if the export is cancelled
+        filas.close()
+        excel.cerrar_archivo()
+
+    if marca is not None:
+        database.set_marca_exportacion(marca)
+    fases.registrar(logger)
+    if progreso is not None:
+        progreso(total, registros)
+    return total
+
+def nombre_cambios(fecha=None):
+    '''Default name of the file of the changes exported at fecha, or now. It has
+        the time too, so a second export on the same day gets a file of its own
+    '''
+    return f"Cambios {fecha or datetime.now():%d-%m-%Y %H.%M}.xlsx"
+
+def exportar_cambios(database, nombre, cabeceras, anadir=False, progreso=None):
+    '''Export the registers added or modified since the last export. They are
+        written to a new file or, with anadir, to a new sheet of the existing file
+        nombre, which is added without reading the sheets it already has.
+        progreso receives the number of registers exported.
+        Returns the number of exported registers
+    '''
+    # Without the file with the previous exports, the changes wouldn't be in any
+    # complete extraction once the mark moves forward
+    if anadir and not os.path.exists(nombre):
+        raise FileNotFoundError(f"No existe {nombre}: haga antes una exportación completa")
+    # The changes already in nombre are behind the mark, so they wouldn't be
+    # exported again after overwriting it
+    if not anadir and os.path.exists(nombre):
+        raise FileExistsError(f"Ya existe {nombre}: los cambios que contiene no se volverían a exportar")
+
+    # The changes go up to the current high-water mark, which is stored once the
+    # file is saved, so a failed or cancelled export is repeated the next time
+    despues = database.get_marca_exportacion()
+    hasta = database.get_marca_registros()
+
+    # The changes are written to a new write-only Excel file, which is added to
+    # the existing one with anadir
+    fases = Fases(f"Cambios {nombre}")
+    excel = Excel()
+    archivo = f"{nombre}.cambios.xlsx" if anadir else nombre
+    excel.crear_archivo_streaming(archivo)
+    filas = database.iter_cambios(despues, hasta)
+    try:
+        with fases.fase("escritura"):
+            hoja = f"Cambios {datetime.now():%d-%m-%Y %H.%M}" if anadir else "Cambios"
+            total = excel.rellenar_hoja_streaming(cabeceras, fases.iterar("lectura", filas),
+                                                  nombre=hoja, progreso=progreso)
+
+        # Save the Excel file
+        with fases.fase("guardado"):
+            excel.guardar_archivo_como()
+            if anadir:
+                anadir_hojas(nombre, archivo)
+    finally:
+        filas.close()
+        excel.cerrar_archivo()
+        if anadir and os.path.exists(archivo):
+            os.remove(archivo)
+
+    database.set_marca_exportacion(hasta)
+    fases.registrar(logger)
+    if progreso is not None:
+        progreso(total)
+    return total
+
+def exportar_particionado(database, destino, cabeceras, particion="mes", desde=None, hasta=None,
+                          procesos=None, progreso=None):
+    '''Export the registers, optionally filtered by fecha_entrada, split by one of
+        the PARTICIONES of the database into one Excel file per group, plus an
+        index file. The files are written in parallel by procesos processes, by
+        default one per core, each one with its own read-only connection.
+        destino is a directory or, if it ends with .zip, a zip file.
+        progreso receives the number of registers exported and the total.
+        Returns the number of exported registers
+    '''
+    # The groups and their size come from the aggregates of the database, and
+    # the biggest ones go first so no process is left alone with one at the end
+    grupos = database.get_resumen_registros(particion, desde, hasta)
+    registros = sum(grupo[1] for grupo in grupos)
+    pendientes = sorted(grupos, key=lambda grupo: grupo[1], reverse=True)
+    archivos = nombres_particiones(particion, [grupo[0] for grupo in grupos])
+
+    comprimir = destino.lower().endswith(".zip")
+    directorio = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(destino))) if comprimir else destino
+    os.makedirs(directorio, exist_ok=True)
+    fases = Fases(f"Exportación por {particion} {destino}")
+    try:
+        with fases.fase("escritura"):
+            total = 0
+            contexto = get_context("spawn")
+            with ProcessPoolExecutor(procesos, mp_context=contexto) as ejecutor:
+                futuros = [ejecutor.submit(_exportar_particion, database.pool.db, database.pool.pragmas,
+                                           particion, valor, desde, hasta,
+                                           os.path.join(directorio, archivos[valor]), cabeceras)
+                           for valor, _, _ in pendientes]
+                try:
+                    for futuro in as_completed(futuros):
+                        total += futuro.result()
+                        if progreso is not None:
+                            progreso(total, registros)
+                except BaseException:
+                    # A failed or cancelled export doesn't start the remaining files
+                    for futuro in futuros:
+                        futuro.cancel()
+                    raise
+
+        # The index lists every file with its registers and importe
+        with fases.fase("indice"):
+            excel = Excel()
+            excel.crear_archivo_streaming(os.path.join(directorio, INDICE))
+            try:
+                excel.rellenar_hoja_streaming(
+                    [particion.capitalize()] + CABECERAS_INDICE,
+                    ([valor, archivos[valor], filas, importe] for valor, filas, importe in grupos),
+                    nombre="Índice")
+                excel.guardar_archivo_como()
+            finally:
+                excel.cerrar_archivo()
+
+        # The workbooks are already compressed, so they are only stored in the zip
+        if comprimir:
+            with fases.fase("compresion"):
+                with zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED) as archivo_zip:
+                    for nombre in [INDICE, *archivos.values()]:
+                        archivo_zip.write(os.path.join(directorio, nombre), nombre)
+    finally:
+        if comprimir:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    fases.registrar(logger)
+    return total
+
+def nombre_particion(particion, valor):
+    '''Name of the file of a group of a partitioned export, without the characters
+        a file name can't have
+    '''
+    valor = "sin valor" if valor is None else re.sub(r'[\\/:*?"<>|]', "_", str(valor))
+    return f"{particion.capitalize()} {valor}.xlsx"
+
+def nombres_particiones(particion, valores):
+    '''Names of the files of the groups of a partitioned export, by value. Groups
+        whose names would be the same once cleaned, or differ only in case, which
+        some file systems ignore, get a number so no file overwrites another
+    '''
+    archivos = {}
+    usados = {INDICE.casefold()}
+    for valor in valores:
+        nombre = nombre_particion(particion, valor)
+        copia = 1
+        while nombre.casefold() in usados:
+            copia += 1
+            nombre = nombre_particion(particion, valor).replace(".xlsx", f" ({copia}).xlsx")
+        usados.add(nombre.casefold())
+        archivos[valor] = nombre
+    return archivos
+
+def _exportar_particion(archivo_db, pragmas, particion, valor, desde, hasta, nombre, cabeceras):
+    '''Export the registers of a group to its own file. Runs in a worker process,
+        so it opens its own read-only connection to the database
+    '''
+    database = Database(archivo_db, pragmas, lectores=1, solo_lectura=True)
+    try:
+        excel = Excel()
+        excel.crear_archivo_streaming(nombre)
+        filas = database.iter_particion(particion, valor, desde, hasta)
+        try:
+            total = excel.rellenar_hoja_streaming(cabeceras, filas)
+            excel.guardar_archivo_como()
+        finally:
+            filas.close()
+            excel.cerrar_archivo()
+    finally:
+        database.close()
+    return total
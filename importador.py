@@ -0,0 +1,455 @@
+'''Streaming import of registers from Excel
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the functions used to import registers from Excel
+    files to the database. The workbook is read in read-only mode and its rows are
+    validated and upserted by identificador in batches, one transaction per batch.
+    The number of committed rows is stored in the database, so an interrupted
+    import can be resumed from the last committed batch. Once a batch fails validation nothing
+    else is inserted, but the rest of the file is still validated so the error
+    report covers every wrong row. The time spent reading, validating and
+    inserting is logged for every import.
+    Each batch is merged into the database through a staging table, which finds
+    the rows repeated in the file, the ones equal to their existing register, which
+    aren't written again, and the ones in conflict with it, and the import returns
+    a report with all of them.
+    Several files can be imported at once: they are read and validated in parallel
+    by a pool of processes, which send their batches through a queue to a single
+    writer, so the database never has two writers competing. The writer applies
+    them file by file in the order of the files, so the result doesn't depend on
+    which file is read first.
+Date: 2023-06-30
+'''
+
+import logging
+import os
+import pickle
+import queue
+import sqlite3
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from excel import Excel
+from instrumentacion import Fases
+from validacion import InformeValidacion
+
+logger = logging.getLogger("importador")
+
+# Number of rows validated and inserted on each transaction
+TAM_LOTE = 1000
+
+# Maximum batches waiting for the writer in a parallel import. The readers wait
+# when it's full, so the memory used doesn't depend on the size of the files
+COLA_LOTES = 16
+
+# Seconds the writer and the readers wait on the queue before checking whether
+# they have to stop
+ESPERA = 0.5
+
+
+class ErrorImportacion(Exception):
+    '''Error raised when an import can't go on. Keeps the number of rows of the file
+        already committed, from which the import can be resumed, and the validation
+        report when the error comes from wrong data
+    '''
+    def __init__(self, mensaje, filas=0, informe=None):
+        super().__init__(mensaje)
+        self.filas = filas
+        self.informe = informe
+
+
+class InformeFusion:
+    '''Report of the merge of the registers of an import: how many were inserted,
+        updated and left unchanged, and which rows were repeated in the file or
+        in conflict with an existing register
+    '''
+    def __init__(self):
+        self.insertadas = 0
+        self.actualizadas = 0
+        self.identicas = 0
+        self.duplicados = []
+        self.conflictos = []
+
+    @property
+    def importadas(self):
+        '''Registers written to the database'''
+        return self.insertadas + self.actualizadas
+
+    @property
+    def filas(self):
+        '''Rows of the file merged'''
+        return self.importadas + self.identicas + len(self.duplicados)
+
+    def extender(self, resultado):
+        '''Add the ResultadoFusion of a batch'''
+        self.insertadas += resultado.insertadas
+        self.actualizadas += resultado.actualizadas
+        self.identicas += resultado.identicas
+        self.duplicados += resultado.duplicados
+        self.conflictos += resultado.conflictos
+
+    def resumen(self, limite=10):
+        '''Text summary of the report, showing at most limite duplicates and conflicts'''
+        lineas = [f"{self.insertadas} registros nuevos, {self.actualizadas} actualizados, "
+                  f"{self.identicas} sin cambios, {len(self.duplicados)} duplicados en el archivo "
+                  f"y {len(self.conflictos)} con conflictos"]
+        lineas += [f"  Fila {fila}: {identificador} repetido de la fila {primera}"
+                   for fila, identificador, primera in self.duplicados[:limite]]
+        lineas += [f"  Fila {fila}: {identificador} difiere del registro {id} en {', '.join(campos)}"
+                   for fila, identificador, id, campos in self.conflictos[:limite]]
+        omitidos = max(len(self.duplicados) - limite, 0) + max(len(self.conflictos) - limite, 0)
+        if omitidos:
+            lineas.append(f"  ... y {omitidos} más")
+        return "\n".join(lineas)
+
+
+class ResultadoImportacion:
+    '''Result of a file of a parallel import: the report of the merge, the rows of
+        the file committed and, if it failed, the error and the validation report.
+        A result is truthy when the file was imported without errors
+    '''
+    def __init__(self, archivo):
+        self.archivo = archivo
+        self.fusion = InformeFusion()
+        self.filas = 0
+        self.error = None
+        self.informe = None
+
+    @property
+    def importadas(self):
+        '''Registers written to the database'''
+        return self.fusion.importadas
+
+    def __bool__(self):
+        return self.error is None
+
+
+def clave_archivo(archivo):
+    '''Key used to store the import progress of a file'''
+    return os.path.abspath(archivo)
+
+def filas_pendientes(database, archivo):
+    '''Number of rows of the file committed by a previous, interrupted import'''
+    return database.get_filas_importadas(clave_archivo(archivo))
+
+def descartar_progreso(database, archivo):
+    '''Forget the progress of a previous import, so the file is imported from the start'''
+    database.delete_importacion(clave_archivo(archivo))
+
+def expandir_archivos(archivos):
+    '''List of the files to import: the given ones, replacing each directory by its
+        Excel files sorted by name
+    '''
+    resultado = []
+    for archivo in archivos:
+        if os.path.isdir(archivo):
+            # Excel keeps temporary ~$ files next to the open workbooks
+            resultado += sorted(os.path.join(archivo, nombre) for nombre in os.listdir(archivo)
+                                if nombre.lower().endswith(".xlsx") and not nombre.startswith("~$"))
+        else:
+            resultado.append(archivo)
+    # A file given twice is imported once
+    return list(dict.fromkeys(resultado))
+
+def comprobar_cabeceras(excel, cabeceras, hechas):
+    '''Check that the first row of the file has the expected headers'''
+    cabecera = next(excel.leer_filas(), None)
+    if cabecera is None or list(cabecera[:len(cabeceras)]) != cabeceras:
+        raise ErrorImportacion("El archivo no tiene los campos correctos", hechas)
+
+def leer_lotes(excel, cabeceras, hechas, tam_lote):
+    '''Read the rows of the file after the hechas already committed, in batches of
+        tam_lote non-empty rows. Yields each batch with the row of the file where it
+        starts and the position of its last row, which counts every row of the
+        file, including the empty ones
+    '''
+    posicion = hechas
+    lote = []
+    inicio = 0
+    for fila in excel.leer_filas(desde=hechas + 2):
+        posicion += 1
+        if all(valor is None for valor in fila):
+            continue
+        if not lote:
+            inicio = posicion + 1
+        lote.append(["" if valor is None else valor for valor in fila[:len(cabeceras)]])
+        if len(lote) == tam_lote:
+            yield lote, inicio, posicion
+            lote = []
+    if lote:
+        yield lote, inicio, posicion
+
+def importar_registros(database, archivo, cabeceras, validador=None, tam_lote=TAM_LOTE,
+                       progreso=None, actualizar=True):
+    '''Import the registers of an Excel file in batches, resuming after the last
+        batch committed by a previous import of the same file.
+        validador receives each batch and the row of the file where it starts, and
+        returns its validation report. progreso receives the number of rows of the
+        file processed and its total rows. actualizar tells whether the registers
+        in conflict with an existing one replace it.
+        Returns the InformeFusion of the registers merged by this call
+    '''
+    clave = clave_archivo(archivo)
+    hechas = database.get_filas_importadas(clave)
+
+    fases = Fases(f"Importación {archivo}")
+    excel = Excel()
+    with fases.fase("lectura"):
+        excel.cargar_archivo_lectura(archivo)
+    try:
+        # Check the headers of the file
+        comprobar_cabeceras(excel, cabeceras, hechas)
+        total = excel.hoja.max_row - 1 if excel.hoja.max_row else None
+
+        # Skip the rows already committed and read the rest in batches
+        importacion = _Importacion(database, clave, validador, hechas, fases, actualizar)
+        for lote, inicio, posicion in fases.iterar("lectura", leer_lotes(excel, cabeceras, hechas, tam_lote)):
+            importacion.lote(lote, inicio, posicion)
+            if progreso is not None:
+                progreso(posicion, total)
+    finally:
+        excel.cerrar_archivo()
+
+    if not importacion.informe:
+        raise ErrorImportacion("El archivo tiene datos incorrectos", importacion.hechas,
+                               importacion.informe)
+
+    # The file is complete, so there's nothing left to resume
+    database.delete_importacion(clave)
+    fases.registrar(logger)
+    return importacion.fusion
+
+def importar_archivos(database, archivos, cabeceras, validador=None, tam_lote=TAM_LOTE,
+                      procesos=None, progreso=None, actualizar=True):
+    '''Import several Excel files, or every Excel file of the given directories.
+        The files are read and validated in parallel by procesos processes, by
+        default one per core, and their batches are written by the calling thread,
+        the only writer, file by file in the order of the files, so the result is
+        the same as importing them one after the other whichever reader finishes
+        first. Each file is imported as importar_registros does, so an interrupted
+        file is resumed and a file with wrong data inserts nothing after its first
+        wrong batch. If two files have the same identificador, the first file
+        inserts it and the later one is a conflict.
+        progreso receives the number of files finished and the total.
+        Returns a ResultadoImportacion for each file, in the order of the files
+    '''
+    archivos = expandir_archivos(archivos)
+    resultados = {archivo: ResultadoImportacion(archivo) for archivo in archivos}
+    importaciones = {}
+    for archivo in archivos:
+        clave = clave_archivo(archivo)
+        importaciones[archivo] = _Importacion(database, clave, None, database.get_filas_importadas(clave),
+                                              Fases(f"Importación {archivo}"), actualizar)
+    if not archivos:
+        return []
+
+    contexto = get_context("spawn")
+    cola = contexto.Queue(COLA_LOTES)
+    parar = contexto.Event()
+    escritor = _Escritor(database, archivos, importaciones, resultados, progreso)
+    with ProcessPoolExecutor(procesos, mp_context=contexto, initializer=_iniciar_lector,
+                             initargs=(cola, parar)) as ejecutor:
+        futuros = {ejecutor.submit(_leer_archivo, archivo, cabeceras, validador, tam_lote,
+                                   importaciones[archivo].hechas): archivo for archivo in archivos}
+        try:
+            while not escritor.terminado:
+                try:
+                    mensaje = cola.get(timeout=ESPERA)
+                except queue.Empty:
+                    # A reader process that dies can't report the end of its file
+                    for futuro, archivo in futuros.items():
+                        if archivo not in escritor.leidos and futuro.done() and futuro.exception() is not None:
+                            escritor.recibir(("fin", archivo, str(futuro.exception()), {}))
+                    continue
+                escritor.recibir(mensaje)
+        except BaseException:
+            # Stop the readers, including the ones waiting for room in the queue
+            parar.set()
+            for futuro in futuros:
+                futuro.cancel()
+            raise
+        finally:
+            escritor.cerrar()
+    return [resultados[archivo] for archivo in archivos]
+
+class _Escritor:
+    '''Writer of a parallel import. The messages of the readers arrive in any
+        order, but they are applied file by file in the order of the files: the
+        ones of a file whose turn hasn't come yet are kept in a temporary file,
+        so they don't take memory, and applied when the files before it finish
+    '''
+    def __init__(self, database, archivos, importaciones, resultados, progreso=None):
+        self.database = database
+        self.archivos = archivos
+        self.importaciones = importaciones
+        self.resultados = resultados
+        self.progreso = progreso
+        self.actual = 0
+        self.leidos = set()
+        self.apartados = {}
+
+    @property
+    def terminado(self):
+        '''Whether every file has been applied'''
+        return self.actual == len(self.archivos)
+
+    def recibir(self, mensaje):
+        '''Apply a message of a reader if its file is the current one, or keep it'''
+        archivo = mensaje[1]
+        if mensaje[0] == "fin":
+            self.leidos.add(archivo)
+        if archivo != self.archivos[self.actual]:
+            if archivo not in self.apartados:
+                self.apartados[archivo] = tempfile.TemporaryFile()
+            pickle.dump(mensaje, self.apartados[archivo])
+            return
+        self._aplicar(mensaje)
+        # A finished file gives the turn to the next one, whose messages may have
+        # been kept already, up to its end too
+        while mensaje is not None and mensaje[0] == "fin" and not self.terminado:
+            mensaje = None
+            for mensaje in self._apartados(self.archivos[self.actual]):
+                self._aplicar(mensaje)
+
+    def cerrar(self):
+        '''Delete the messages kept for files that won't be applied'''
+        for apartado in self.apartados.values():
+            apartado.close()
+        self.apartados.clear()
+
+    def _apartados(self, archivo):
+        '''Messages kept for a file, in the order they arrived'''
+        apartado = self.apartados.pop(archivo, None)
+        if apartado is None:
+            return
+        with apartado:
+            apartado.seek(0)
+            while True:
+                try:
+                    yield pickle.load(apartado)
+                except EOFError:
+                    return
+
+    def _aplicar(self, mensaje):
+        '''Write a batch of the current file, or finish it'''
+        if mensaje[0] == "lote":
+            _, archivo, lote, inicio, posicion, informe = mensaje
+            if self.resultados[archivo].error is None:
+                try:
+                    self.importaciones[archivo].lote(lote, inicio, posicion, informe)
+                except (sqlite3.Error, ValueError, TypeError) as error:
+                    # A value that can't be stored only fails its own file. The
+                    # batches already committed are kept, and the file can be
+                    # resumed from them
+                    self.resultados[archivo].error = str(error)
+        else:
+            _, archivo, error, tiempos = mensaje
+            _terminar(self.database, self.importaciones[archivo], self.resultados[archivo], error, tiempos)
+            self.actual += 1
+            if self.progreso is not None:
+                self.progreso(self.actual, len(self.archivos))
+
+
+def _terminar(database, importacion, resultado, error, tiempos):
+    '''Fill in the result of a file of a parallel import once its reader is done'''
+    if resultado.error is None:
+        resultado.error = error
+    if resultado.error is None and not importacion.informe:
+        resultado.error = "El archivo tiene datos incorrectos"
+    resultado.fusion = importacion.fusion
+    resultado.filas = importacion.hechas
+    resultado.informe = importacion.informe
+    if resultado:
+        # The file is complete, so there's nothing left to resume
+        database.delete_importacion(importacion.clave)
+    for fase, segundos in tiempos.items():
+        importacion.fases.tiempos[fase] = importacion.fases.tiempos.get(fase, 0.0) + segundos
+    importacion.fases.registrar(logger)
+
+
+################################################################################
+# Readers of a parallel import, which run in the worker processes
+
+_cola = None
+_parar = None
+
+def _iniciar_lector(cola, parar):
+    '''Keep the queue of batches and the stop signal in the worker process'''
+    global _cola, _parar
+    _cola = cola
+    _parar = parar
+    # A stopped import doesn't read what is left in the queue, so the process
+    # mustn't wait for it to be read before exiting. When the import isn't
+    # stopped, the writer reads everything up to the end of every file
+    _cola.cancel_join_thread()
+
+def _enviar(mensaje):
+    '''Send a message to the writer, waiting for room in the queue. Returns False
+        if the import has been stopped meanwhile
+    '''
+    while not _parar.is_set():
+        try:
+            _cola.put(mensaje, timeout=ESPERA)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _leer_archivo(archivo, cabeceras, validador, tam_lote, hechas):
+    '''Read and validate the batches of a file after the hechas rows already
+        committed, and send them to the writer. Once a batch has errors the next
+        ones won't be inserted, so only their validation reports are sent
+    '''
+    fases = Fases(archivo)
+    error = None
+    try:
+        excel = Excel()
+        with fases.fase("lectura"):
+            excel.cargar_archivo_lectura(archivo)
+        try:
+            comprobar_cabeceras(excel, cabeceras, hechas)
+            correcto = True
+            for lote, inicio, posicion in fases.iterar("lectura", leer_lotes(excel, cabeceras, hechas, tam_lote)):
+                informe = None
+                if validador is not None:
+                    with fases.fase("validacion"):
+                        informe = validador(lote, inicio)
+                    correcto = correcto and bool(informe)
+                if not _enviar(("lote", archivo, lote if correcto else None, inicio, posicion, informe)):
+                    return
+        finally:
+            excel.cerrar_archivo()
+    except Exception as excepcion:
+        error = str(excepcion)
+    _enviar(("fin", archivo, error, fases.tiempos))
+
+
+class _Importacion:
+    '''State of an import in progress: the batches are inserted until one of them
+        fails validation, and from then on they are only validated
+    '''
+    def __init__(self, database, clave, validador, hechas, fases, actualizar=True):
+        self.database = database
+        self.clave = clave
+        self.validador = validador
+        self.hechas = hechas
+        self.fases = fases
+        self.actualizar = actualizar
+        self.informe = InformeValidacion()
+        self.fusion = InformeFusion()
+
+    def lote(self, lote, inicio, posicion, informe=None):
+        '''Validate a batch, unless its report is given, and, while there are no
+            errors, merge it together with the position reached in the file in a
+            single transaction. A batch of None only adds its report
+        '''
+        if informe is None and self.validador is not None:
+            with self.fases.fase("validacion"):
+                informe = self.validador(lote, inicio)
+        if informe is not None:
+            self.informe.extender(informe)
+        if self.informe and lote is not None:
+            with self.fases.fase("insercion"):
+                self.fusion.extender(self.database.merge_lote_registros(
+                    lote, self.clave, posicion, inicio, self.actualizar))
+            self.hechas = posicion
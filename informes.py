@@ -0,0 +1,55 @@
+'''Summary reports of the registers
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the summary reports exported to Excel. Instead of
+    dumping every register, the database groups them by operador, estado, day,
+    week and month and returns only the aggregates, which are written as small
+    summary sheets. A report of a whole year moves a few hundred rows.
+Date: 2023-06-30
+'''
+
+from db import Database
+from excel import Excel
+
+# Sheets of the summary report: name, method of Database that reads the
+# aggregates, grouping and headers
+RESUMENES = [
+    ("Por operador", Database.get_resumen_registros, "operador",
+     ["Operador", "Registros", "Importe"]),
+    ("Por estado", Database.get_resumen_registros, "estado",
+     ["Estado", "Registros", "Importe"]),
+    ("Por día", Database.get_resumen_registros, "dia",
+     ["Día", "Registros", "Importe"]),
+    ("Por semana", Database.get_resumen_registros, "semana",
+     ["Semana", "Registros", "Importe"]),
+    ("Por mes", Database.get_resumen_registros, "mes",
+     ["Mes", "Registros", "Importe"]),
+    ("Incidencias por operador", Database.get_resumen_incidencias, "operador",
+     ["Operador", "Incidencias", "Llamadas", "Media", "Mínimo", "Máximo"]),
+    ("Incidencias por mes", Database.get_resumen_incidencias, "mes",
+     ["Mes", "Incidencias", "Llamadas", "Media", "Mínimo", "Máximo"]),
+]
+
+
+def exportar_resumen(database, nombre, desde=None, hasta=None, progreso=None):
+    '''Export the summary report of the registers, optionally filtered by
+        fecha_entrada, to an Excel file with one sheet per grouping.
+        progreso receives the number of sheets written and the total.
+        Returns the number of summary rows exported
+    '''
+    excel = Excel()
+    excel.crear_archivo_streaming(nombre)
+    try:
+        # Aggregate the registers in the database and write each result as a sheet
+        total = 0
+        for hechas, (hoja, resumen, agrupacion, cabeceras) in enumerate(RESUMENES, 1):
+            filas = resumen(database, agrupacion, desde, hasta)
+            total += excel.rellenar_hoja_streaming(cabeceras, filas, nombre=hoja)
+            if progreso is not None:
+                progreso(hechas, len(RESUMENES))
+
+        # Save the Excel file
+        excel.guardar_archivo_como()
+    finally:
+        excel.cerrar_archivo()
+    return total
@@ -0,0 +1,239 @@
+'''Instrumentation of the database and of the long operations
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the classes used to find out where the time goes.
+    The connections of the database time every statement and count its rows,
+    including the time spent fetching them, and keep the totals in memory; the
+    statements slower than a threshold are logged together with their query plan.
+    Long operations, such as exports and imports, time each of their phases.
+Date: 2023-06-30
+'''
+
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache, wraps
+
+logger = logging.getLogger("db")
+
+
+@lru_cache(maxsize=512)
+def normalizar(sql):
+    '''Statement with its whitespace collapsed, used as the key of its statistics'''
+    return " ".join(sql.split())
+
+
+class Estadisticas:
+    '''Thread-safe counters of calls, time and rows, by key'''
+    def __init__(self):
+        self._bloqueo = threading.Lock()
+        self._datos = {}
+
+    def registrar(self, clave, segundos, filas=0, llamadas=1):
+        '''Add a call, or only its time and rows if llamadas is 0'''
+        with self._bloqueo:
+            datos = self._datos.get(clave)
+            if datos is None:
+                datos = self._datos[clave] = {"llamadas": 0, "segundos": 0.0, "maximo": 0.0, "filas": 0}
+            datos["llamadas"] += llamadas
+            datos["segundos"] += segundos
+            datos["maximo"] = max(datos["maximo"], segundos)
+            datos["filas"] += filas
+
+    def instantanea(self):
+        '''Copy of the counters, sorted by total time, with the average time of a call'''
+        with self._bloqueo:
+            datos = {clave: dict(valores) for clave, valores in self._datos.items()}
+        for valores in datos.values():
+            valores["media"] = valores["segundos"] / valores["llamadas"] if valores["llamadas"] else 0.0
+        return dict(sorted(datos.items(), key=lambda item: item[1]["segundos"], reverse=True))
+
+    def reiniciar(self):
+        '''Set every counter back to zero'''
+        with self._bloqueo:
+            self._datos.clear()
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    '''Cursor that times its statements, fetches included, and logs the slow ones'''
+    def execute(self, sql, params=()):
+        self._iniciar(sql, params)
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._medir(time.perf_counter() - inicio, max(self.rowcount, 0), llamadas=1)
+
+    def executemany(self, sql, params):
+        self._iniciar(sql, None)
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self._medir(time.perf_counter() - inicio, max(self.rowcount, 0), llamadas=1)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = super().fetchone()
+        self._medir(time.perf_counter() - inicio, fila is not None)
+        return fila
+
+    def fetchmany(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        filas = super().fetchmany(*args, **kwargs)
+        self._medir(time.perf_counter() - inicio, len(filas))
+        return filas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = super().fetchall()
+        self._medir(time.perf_counter() - inicio, len(filas))
+        return filas
+
+    def _iniciar(self, sql, params):
+        '''Start measuring a new statement'''
+        self._sql = sql
+        self._params = params
+        self._segundos = 0.0
+        self._lenta = False
+
+    def _medir(self, segundos, filas, llamadas=0):
+        '''Add time and rows to the current statement, and log it once it's slow'''
+        sql = getattr(self, "_sql", None)
+        if sql is None:
+            return
+        self._segundos += segundos
+        conn = self.connection
+        conn.estadisticas.registrar(normalizar(sql), segundos, filas, llamadas)
+        if conn.umbral_lentas is not None and not self._lenta and self._segundos >= conn.umbral_lentas:
+            self._lenta = True
+            registrar_lenta(conn, sql, self._params, self._segundos)
+
+
+class ConexionInstrumentada(sqlite3.Connection):
+    '''Connection whose cursors are instrumented. estadisticas and umbral_lentas,
+        the seconds from which a statement is logged, are set after connecting
+    '''
+    estadisticas = None
+    umbral_lentas = None
+
+    def cursor(self, factory=CursorInstrumentado):
+        return super().cursor(factory)
+
+    # The shortcuts of sqlite3.Connection create plain cursors, so they are
+    # redirected to the instrumented ones
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+    def executescript(self, sql):
+        inicio = time.perf_counter()
+        try:
+            return super().executescript(sql)
+        finally:
+            self.estadisticas.registrar("executescript", time.perf_counter() - inicio)
+
+
+def registrar_lenta(conn, sql, params, segundos):
+    '''Log a slow statement with its query plan. The plan can only be read for
+        statements executed once, whose parameters are known
+    '''
+    plan = ""
+    if params is not None:
+        try:
+            cur = sqlite3.Cursor(conn)
+            plan = "\n".join(f"    {fila[3]}" for fila in cur.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+            cur.close()
+        except sqlite3.Error as error:
+            plan = f"    (sin plan: {error})"
+    logger.warning("Consulta lenta (%.3f s): %s\n%s", segundos, normalizar(sql), plan)
+
+
+def instrumentar_metodo(metodo):
+    '''Decorator that adds the time and rows of every call of a method of Database
+        to its statistics of methods
+    '''
+    @wraps(metodo)
+    def envoltorio(self, *args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            resultado = metodo(self, *args, **kwargs)
+        finally:
+            segundos = time.perf_counter() - inicio
+        filas = len(resultado) if isinstance(resultado, list) else 0
+        self.estadisticas_metodos.registrar(metodo.__name__, segundos, filas)
+        return resultado
+    return envoltorio
+
+
+def instrumentar_metodos(excepto=()):
+    '''Class decorator that instruments every public method of a class, except
+        the ones given
+    '''
+    def decorador(clase):
+        for nombre, metodo in list(vars(clase).items()):
+            if callable(metodo) and not nombre.startswith("_") and nombre not in excepto:
+                setattr(clase, nombre, instrumentar_metodo(metodo))
+        return clase
+    return decorador
+
+
+class Fases:
+    '''Time of each phase of a long operation. Phases can be nested: while an
+        inner phase runs, the time doesn't count for the outer one
+    '''
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.tiempos = {}
+        self._pila = []
+        self._desde = None
+
+    @contextmanager
+    def fase(self, nombre):
+        '''Count the time of a block for a phase'''
+        self._entrar(nombre)
+        try:
+            yield
+        finally:
+            self._salir()
+
+    def iterar(self, nombre, iterable):
+        '''Iterate over iterable, counting the time spent getting each item for a phase'''
+        iterador = iter(iterable)
+        while True:
+            self._entrar(nombre)
+            try:
+                elemento = next(iterador)
+            except StopIteration:
+                return
+            finally:
+                self._salir()
+            yield elemento
+
+    def resumen(self):
+        '''Text with the time of every phase'''
+        fases = ", ".join(f"{fase} {segundos:.3f} s" for fase, segundos in self.tiempos.items())
+        return f"{self.nombre}: {fases}"
+
+    def registrar(self, logger):
+        '''Log the time of every phase'''
+        logger.info(self.resumen())
+
+    def _entrar(self, nombre):
+        ahora = time.perf_counter()
+        if self._pila:
+            self._acumular(self._pila[-1], ahora)
+        self._pila.append(nombre)
+        self._desde = ahora
+
+    def _salir(self):
+        ahora = time.perf_counter()
+        self._acumular(self._pila.pop(), ahora)
+        self._desde = ahora
+
+    def _acumular(self, nombre, ahora):
+        self.tiempos[nombre] = self.tiempos.get(nombre, 0.0) + ahora - self._desde
@@ -10,17 +10,53 @@ It's a general purpose form to structure and cleanly define data models. It can
 any project that has a well-defined data structure.
 '''
 
-# Import libraries
+# Start measuring the start-up time before anything else is imported
+import time
+INICIO_ARRANQUE = time.perf_counter()
+
+# Import libraries. The export and import modules (openpyxl, NumPy) are imported
+# the first time they are used, so they don't slow down the start-up
 import tkinter as tk
-from tkinter import PhotoImage, ttk, messagebox
-from PIL import Image, ImageTk
+from tkinter import PhotoImage, ttk, messagebox, filedialog
 from tkcalendar import DateEntry
 import db
-from excel import Excel
+import auditoria
+import copias
+import tareas
+import navegador
 import tk_utils
 import configparser
+import datetime
+import logging
 import os
-import re
+import sqlite3
+import sys
+
+# Modules whose import is deferred until they are used
+MODULOS_DIFERIDOS = ["exportador", "importador", "validacion", "informes", "openpyxl", "numpy", "PIL"]
+
+
+################################################################################
+fases_arranque = [("Importaciones", time.perf_counter())]
+
+def marcar_fase(nombre):
+    '''Create a function that stores the time at which a start-up phase ends'''
+    fases_arranque.append((nombre, time.perf_counter()))
+
+def informe_arranque():
+    '''Create a function that prints the time taken by each start-up phase, in the
+        style of python -X importtime, and which deferred modules are already loaded
+    '''
+    marcar_fase("Primer frame")
+    print("arranque: fase                 |    ms | acumulado", file=sys.stderr)
+    anterior = INICIO_ARRANQUE
+    for nombre, instante in fases_arranque:
+        print(f"arranque: {nombre:<20} | {(instante - anterior) * 1000:5.0f} | "
+              f"{(instante - INICIO_ARRANQUE) * 1000:9.0f}", file=sys.stderr)
+        anterior = instante
+    cargados = [modulo for modulo in MODULOS_DIFERIDOS if modulo in sys.modules]
+    print(f"arranque: módulos diferidos cargados: {', '.join(cargados) or 'ninguno'}",
+          file=sys.stderr)
 
 
 ################################################################################
@@ -41,6 +77,15 @@ def buscar_id():
         else:
             messagebox.showerror("Error", "No existe ningún registro con ese ID")
 
+def buscar_texto(event=None):
+    '''Create a function that searches the registers containing the given words'''
+    # If the search field is empty, show an error message
+    if not busqueda.get().strip():
+        messagebox.showerror("Error", "Introduzca el texto a buscar")
+        return
+    # Show the registers found, sorted by relevance
+    navegador.ResultadosBusqueda(ventana_principal, database, cabeceras, busqueda.get().strip())
+
 def submit():
     '''Create a function that submits the form'''
     # If operador is not selected, show an error message
@@ -57,13 +102,9 @@ def submit():
         messagebox.showerror("Error", "Todos los campos son obligatorios")
         return
     
-    # If the record already exists, ask for confirmation to overwrite it
-    if database.get_registro_by("identificador", identificador.get()):
-        if not messagebox.askyesno("Confirmar", "Ya existe un registro con ese ID. ¿Desea sobreescribirlo?"):
-            return
-        
-    # If the record doesn't exist, ask for confirmation to create it
-    elif not messagebox.askyesno("Confirmar", "¿Desea crear un nuevo registro?"):
+    # Ask for confirmation to save the record, which overwrites the one with the same ID
+    if not messagebox.askyesno("Confirmar", "¿Desea guardar el registro? Si ya existe un "
+                               "registro con ese ID, se sobreescribirá"):
         return
 
     # Create a list with the values of the entry fields and comboboxes
@@ -80,8 +121,13 @@ def submit():
         observaciones.get('1.0', "end-1c"),
     ]
 
-    # Insert the record in the database
-    database.insert_registro(values)
+    # Insert the record in the database, or update the one with the same ID
+    if database.upsert_registro(values):
+        auditar(f"Crear registro {identificador.get()}")
+        messagebox.showinfo("Información", "Se ha creado un nuevo registro")
+    else:
+        auditar(f"Editar registro {identificador.get()}")
+        messagebox.showinfo("Información", "Se ha actualizado el registro existente")
 
     # Clear the entry fields and comboboxes
     clear()
@@ -128,19 +174,24 @@ def exportar_aux():
         Create a function that shows an auxiliary window to choose whether to 
         extract all the registers or only ones within a certain date range
     '''
-    # Create a new window
-    export_window = tk.Toplevel()
+    # The window is built the first time and hidden, not destroyed, when closed
+    ventanas.mostrar("exportar", construir_exportar)
+
+def construir_exportar(export_window):
+    '''Create a function that adds the widgets of the export window, and returns
+        the one that resets them every time the window is opened again
+    '''
     export_window.title("Exportar")
     export_window.resizable(False, False)
     export_window.iconbitmap("imgs/favicon.ico")
 
     # Create a label to show a message to the user
     label = tk.Label(export_window, text="¿Qué registros desea exportar?", font=("Gotham Bold", 14))
-    label.grid(row=0, column=0, columnspan=3, pady=10)
+    label.grid(row=0, column=0, columnspan=4, pady=10)
 
     # Create a button to export all the registers
     button_all = tk.Button(export_window, text="Todos", 
-            command= lambda: [exportar(0, None), export_window.destroy()])
+            command= lambda: [exportar(0, None, resumen=resumen.get()), export_window.withdraw()])
     button_all.grid(row=1, column=0, pady=3)
 
     # Create a frame to group the date selectors
@@ -157,7 +208,8 @@ def exportar_aux():
 
     # Create a button to export only the registers within a certain date range
     button_range = tk.Button(frame, text="Rango de fechas", 
-            command= lambda: [exportar(1, f"{date_from.get()} - {date_to.get()}"), export_window.destroy()])
+            command= lambda: [exportar(1, f"{date_from.get()} - {date_to.get()}", resumen=resumen.get()),
+                              export_window.withdraw()])
     button_range.pack(pady=3)
 
     # Create a frame to group the date selector and button
@@ -169,126 +221,197 @@ def exportar_aux():
                         borderwidth=2, locale="es_ES", date_pattern="dd-MM-yyyy")
     date.pack(pady=3)
     button_date = tk.Button(frame2, text="A partir de una fecha",
-            command= lambda: [exportar(2, f"{date.get()}"), export_window.destroy()])
+            command= lambda: [exportar(2, f"{date.get()}", resumen=resumen.get()), export_window.withdraw()])
     button_date.pack(pady=3)
 
-    # Create a button to close the window
-    button_close = tk.Button(export_window, text="Cerrar", command=export_window.destroy)
-    button_close.grid(row=2, column=0, columnspan=3, pady=3)
+    # Create a frame to group the buttons of the incremental export
+    frame3 = tk.Frame(export_window)
+    frame3.grid(row=1, column=3, pady=3)
+
+    # Create a button to export only the registers added or modified since the last
+    # export, to a new file or to a new sheet of the global extraction
+    anadir = tk.BooleanVar(export_window, value=False)
+    check_anadir = tk.Checkbutton(frame3, text="Añadir a la extracción global", variable=anadir)
+    check_anadir.pack(pady=3)
+    button_cambios = tk.Button(frame3, text="Cambios desde la última",
+            command= lambda: [exportar(3, None, anadir=anadir.get()), export_window.withdraw()])
+    button_cambios.pack(pady=3)
+
+    # Create a check button to export only the summary report instead of every register
+    resumen = tk.BooleanVar(export_window, value=False)
+    check_resumen = tk.Checkbutton(export_window, text="Solo resumen (por operador, estado, día, semana y mes)",
+            variable=resumen)
+    check_resumen.grid(row=2, column=0, columnspan=4, pady=3)
 
-    tk_utils.centrar_ventana(export_window)
-
-def exportar(selector, fechas="", window=None):
-    '''Create a function that extracts the data from the database and creates an Excel file'''
-    # Get the data from the database
-    data = None
-    nombre = None
+    # Create a button to close the window
+    button_close = tk.Button(export_window, text="Cerrar", command=export_window.withdraw)
+    button_close.grid(row=3, column=0, columnspan=4, pady=3)
+
+    # Reopening the window starts again from today and with the options unchecked
+    def reiniciar():
+        for selector in (date_from, date_to, date):
+            selector.set_date(datetime.date.today())
+        anadir.set(False)
+        resumen.set(False)
+    return reiniciar
+
+def exportar(selector, fechas="", window=None, resumen=False, anadir=False):
+    '''Create a function that extracts the data from the database and creates an Excel
+        file, with every register, only with the summary report or only with the
+        registers changed since the last export
+    '''
+    # Choose the date filter and the name of the file
+    desde = None
+    hasta = None
     if selector == 1:
-        aux = fechas.split(" - ")
-        fechas = (aux[0], aux[1])
-        data = database.get_all_registros_fecha_entrada(fechas)
-        nombre = f"Extracción {aux[0]} - {aux[1]}.xlsx"
+        desde, hasta = fechas.split(" - ")
+        nombre = f"Extracción {desde} - {hasta}.xlsx"
     elif selector == 2:
-        data = database.get_all_registros_fecha_entrada(fechas)
+        desde = fechas
         nombre = f"Extracción {fechas}.xlsx"
     else:
-        data = database.get_all_registros()
         nombre = "Extracción global.xlsx"
 
-    # Create a new Excel file
-    excel = Excel()
-    excel.crear_archivo(nombre)
-
-    # Add headers to the Excel file
-    excel.rellenar_cabeceras(cabeceras)
-
-    # Add the data to the Excel file
-    excel.rellenar_hoja(data)
-
-    # Format the Excel file
-    excel.formato_hoja()
-    excel.formato_cabecera()
-
-    # Save the Excel file
-    excel.guardar_archivo_como()
-
-    # Close the Excel file
-    excel.cerrar_archivo()
-
-    # Show a message to the user
-    messagebox.showinfo("Información", "El archivo se ha exportado correctamente")
-
-def verificar_cabeceras(headers):
-    '''Create a function that verifies the Excel file headers'''
-    # Check if the headers are correct
-    if headers != cabeceras[1:]:
-        # Show a message to the user
-        messagebox.showerror("Error", "El archivo no tiene los campos correctos")
-        return False
-    return True
-
-def verificar_datos(datos):
-    '''Create a function that verifies the integrity of the data'''
-    date_regex = r"^\d{2}-\d{2}-\d{4}$"
-    for registro in datos:
-        # Check if fecha entrada has a valid date format
-        if not re.match(date_regex, registro[0]):
-            messagebox.showerror("Error", "Fecha de entrada incorrecta")
-            return False
-        # Check if the next 2 fields are empty
-        if registro[1] != "" or registro[2] != "":
-            messagebox.showerror("Error", "El registro tiene campos vacíos")
-            return False
-        # Check if importe is a valid number
-        try:
-            float(registro[3])
-        except ValueError:
-            messagebox.showerror("Error", "Importe incorrecto")
-            return False
-        # If estado is INCIDENCIA, check whether the next fields are valid
-        if registro[4] == "INCIDENCIA":
-            # Check if registro[5][8][9] are empty
-            if registro[5] != "" or registro[8] != "" or registro[9] != "":
-                messagebox.showerror("Error", "El registro tiene campos vacíos")
-                return False
-            # Check if registro[6] is a valid integer
-            try:
-                int(registro[6])
-            except ValueError:
-                messagebox.showerror("Error", "Número de llamadas incorrecto")
-                return False
-            # Check if registro[7] is a valid date
-            if not re.match(date_regex, registro[7]):
-                messagebox.showerror("Error", "Fecha de resolución incorrecta")
-                return False
-    return True
+    # The incremental export writes only the changes since the last export, to a
+    # new file or to a new sheet of the global extraction
+    if selector == 3:
+        import exportador
+        if not anadir:
+            nombre = exportador.nombre_cambios()
+        tarea = gestor_tareas.lanzar(
+            f"Exportando cambios a {nombre}", exportador.exportar_cambios,
+            database, nombre, cabeceras, anadir,
+            al_terminar=lambda total: [
+                auditar(f"Exportar cambios a {nombre} ({total} registros)"),
+                messagebox.showinfo("Información", f"Se han exportado {total} registros nuevos o modificados")],
+            al_fallar=lambda error: [
+                auditar(f"Exportar cambios a {nombre} fallida: {error}"),
+                messagebox.showerror("Error", f"No se ha podido exportar el archivo: {error}")],
+            al_cancelar=lambda: [
+                auditar(f"Exportar cambios a {nombre} cancelada"),
+                messagebox.showinfo("Información", "Exportación cancelada")])
+        tk_utils.DialogoProgreso(ventana_principal, tarea)
+        return
+
+    # The summary report only needs the aggregates computed by the database
+    if resumen:
+        import informes
+        nombre = nombre.replace("Extracción", "Resumen")
+        tarea = gestor_tareas.lanzar(
+            f"Exportando {nombre}", informes.exportar_resumen, database, nombre, desde, hasta,
+            al_terminar=lambda total: [
+                auditar(f"Exportar {nombre} ({total} filas)"),
+                messagebox.showinfo("Información", f"El resumen se ha exportado correctamente ({total} filas)")],
+            al_fallar=lambda error: [
+                auditar(f"Exportar {nombre} fallida: {error}"),
+                messagebox.showerror("Error", f"No se ha podido exportar el resumen: {error}")],
+            al_cancelar=lambda: [
+                auditar(f"Exportar {nombre} cancelada"),
+                messagebox.showinfo("Información", "Exportación cancelada")])
+        tk_utils.DialogoProgreso(ventana_principal, tarea)
+        return
+
+    # Stream the data from the database to a new Excel file in the background
+    import exportador
+    tarea = gestor_tareas.lanzar(
+        f"Exportando {nombre}", exportador.exportar_registros,
+        database, nombre, cabeceras, desde, hasta,
+        al_terminar=lambda total: [
+            auditar(f"Exportar {nombre} ({total} registros)"),
+            messagebox.showinfo("Información", f"El archivo se ha exportado correctamente ({total} registros)")],
+        al_fallar=lambda error: [
+            auditar(f"Exportar {nombre} fallida: {error}"),
+            messagebox.showerror("Error", f"No se ha podido exportar el archivo: {error}")],
+        al_cancelar=lambda: [
+            auditar(f"Exportar {nombre} cancelada"),
+            messagebox.showinfo("Información", "Exportación cancelada")])
+
+    # Show the progress to the user
+    tk_utils.DialogoProgreso(ventana_principal, tarea)
 
 def importar():
     '''Create a function that imports data from an Excel file to the database'''
-    # Create a new Excel file
-    excel = Excel()
-    excel.cargar_archivo()
-
-    # Check format integrity and insert the data in the database
-    if not verificar_cabeceras(excel.datos[0]):
-        messagebox.showerror("Error", "El archivo no tiene el formato correcto")
-        return
-    elif not verificar_datos(excel.datos[1:]):
+    # Ask for the file to import
+    archivo = filedialog.askopenfilename(filetypes=[("Excel", "*.xlsx")])
+    if not archivo:
         return
-    else:
-        # Delete the headers from the data
-        del excel.datos[0]
 
-        # Insert the data in the database
-        database.insert_multiples_registros(excel.datos)
+    # If a previous import of the file was interrupted, ask whether to resume it
+    import importador
+    import validacion
+    hechas = importador.filas_pendientes(database, archivo)
+    if hechas and not messagebox.askyesno("Confirmar",
+            f"La importación de este archivo se interrumpió tras {hechas} filas. "
+            "¿Desea continuar desde ese punto?"):
+        importador.descartar_progreso(database, archivo)
+
+    # Check format integrity and insert the data in the database in batches, in
+    # the background
+    tarea = gestor_tareas.lanzar(
+        f"Importando {os.path.basename(archivo)}", importador.importar_registros,
+        database, archivo, cabeceras[1:], validacion.validar_registros,
+        tam_lote_importacion or importador.TAM_LOTE,
+        al_terminar=lambda fusion: [
+            auditar(f"Importar {archivo} ({fusion.importadas} registros)"),
+            messagebox.showinfo("Información", f"Importación terminada: {fusion.resumen()}")],
+        al_fallar=lambda error: error_importacion(archivo, error),
+        al_cancelar=lambda: [
+            auditar(f"Importar {archivo} cancelada ({filas_guardadas(archivo)} filas guardadas)"),
+            messagebox.showinfo(
+                "Información", "Importación cancelada. Las filas ya guardadas se conservan "
+                "y la importación puede continuar desde ese punto")])
+
+    # Show the progress to the user
+    tk_utils.DialogoProgreso(ventana_principal, tarea)
+
+def filas_guardadas(archivo):
+    '''Create a function that reads how many rows of a file an unfinished import
+        has committed, which are kept
+    '''
+    import importador
+    try:
+        return importador.filas_pendientes(database, archivo)
+    except sqlite3.Error:
+        return "?"
+
+def error_importacion(archivo, error):
+    '''Create a function that records and shows why an import failed'''
+    import importador
+    auditar(f"Importar {archivo} fallida ({filas_guardadas(archivo)} filas guardadas): {error}")
+    if isinstance(error, importador.ErrorImportacion):
+        detalle = f"\n\n{error.informe.resumen()}" if error.informe is not None else ""
+        messagebox.showerror("Error", f"{error}. Se han guardado {error.filas} filas del archivo, "
+                             f"la importación puede continuar desde ese punto{detalle}")
+    else:
+        messagebox.showerror("Error", f"No se ha podido importar el archivo: {error}")
 
-    # Show a message to the user
-    messagebox.showinfo("Información", "El archivo se ha importado correctamente")
+def copia_seguridad():
+    '''Create a function that backs up the database now, in the background,
+        while the form can still be used
+    '''
+    tarea = gestor_tareas.lanzar(
+        "Copia de seguridad", copias_seguridad.copiar,
+        al_terminar=lambda copia: [
+            auditar(f"Copia de seguridad {copia.archivo}"),
+            messagebox.showinfo("Información", f"Copia de seguridad guardada en {copia.archivo}")],
+        al_fallar=lambda error: [
+            auditar(f"Copia de seguridad fallida: {error}"),
+            messagebox.showerror("Error", f"No se ha podido hacer la copia de seguridad: {error}")],
+        al_cancelar=lambda: [
+            auditar("Copia de seguridad cancelada"),
+            messagebox.showinfo("Información", "Copia de seguridad cancelada")])
+    tk_utils.DialogoProgreso(ventana_principal, tarea)
+
+def auditar(accion):
+    '''Create a function that adds an action of the selected operator to the audit trail'''
+    registro_auditoria.registrar(operador.get() or "-", accion)
 
 def help():
     '''Create a function that displays an overlay with help for the user'''
-    # Create a new window
-    ventana_ayuda = tk.Toplevel(ventana_principal)
+    ventanas.mostrar("ayuda", construir_ayuda)
+
+def construir_ayuda(ventana_ayuda):
+    '''Create a function that adds the widgets of the help window'''
     ventana_ayuda.title("Ayuda")
     ventana_ayuda.resizable(False, False)
     ventana_ayuda.iconbitmap("imgs/favicon.ico")
@@ -311,6 +434,8 @@ def help():
         llamadas", que pasarán a ser obligatorios.\n
         - Para buscar un registro, introduzca su ID en el campo correspondiente y
         pulse el botón "Buscar" (icono de lupa).\n
+        - Para buscar registros por cualquier palabra de su identificador, operador
+        u observaciones, escríbala en el campo "Buscar" y pulse Intro.\n
         - Para modificar un registro, busque el registro y modifique los campos que
         desee. Pulse el botón "Confirmar" para guardar los cambios.\n
         - Para eliminar un registro, busque el registro y pulse el botón "Eliminar".
@@ -326,15 +451,9 @@ def help():
     help_label.grid(row=1, column=0, padx=10, pady=10, sticky="NSEW")
 
     # Create a button to close the window
-    close_button = ttk.Button(frame, text="Cerrar", command=ventana_ayuda.destroy)
+    close_button = ttk.Button(frame, text="Cerrar", command=ventana_ayuda.withdraw)
     close_button.grid(row=2, column=0, padx=10, pady=10, sticky="NSEW")
 
-    # Center the window
-    tk_utils.centrar_ventana(ventana_ayuda)
-
-    # Show the window
-    ventana_ayuda.mainloop()
-
 def about():
     '''Mensaje de información'''
     messagebox.showinfo("Información", "Aplicación creada por Alejandro Sánchez Rodríguez")
@@ -344,14 +463,43 @@ def about():
 config = configparser.ConfigParser()
 config.read('config.ini')
 
+# Log the slow queries and the time of the exports and imports
+logging.basicConfig(
+    filename=os.path.join(os.path.dirname(__file__), config.get("LOG", "FILENAME", fallback="app.log")),
+    level=config.get("LOG", "LEVEL", fallback="INFO"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
 # Create a database instance
 DB_FILE = config["DB"]["DB_FILENAME"]
 DB_FILE = os.path.join(os.path.dirname(__file__), DB_FILE)
-database = db.Database(DB_FILE)
+DB_PRAGMAS = {clave: valor for clave, valor in config["DB"].items() if clave in db.PRAGMAS}
+DB_READERS = config.getint("DB", "READERS", fallback=db.LECTORES)
+DB_SLOW_QUERY_MS = config.getfloat("DB", "SLOW_QUERY_MS", fallback=None)
+database = db.Database(DB_FILE, DB_PRAGMAS, DB_READERS,
+                       None if DB_SLOW_QUERY_MS is None else DB_SLOW_QUERY_MS / 1000)
+database.migrate()
+
+# Write the audit trail in the background, in batches
+registro_auditoria = auditoria.Auditoria(
+    database,
+    config.getint("AUDIT", "BATCH_SIZE", fallback=auditoria.TAM_LOTE),
+    config.getfloat("AUDIT", "INTERVAL", fallback=auditoria.INTERVALO))
+
+# Back up the database in the background, every interval, while it's in use
+copias_seguridad = copias.CopiasSeguridad(
+    database,
+    os.path.join(os.path.dirname(__file__), config.get("BACKUP", "DIRECTORY", fallback="copias")),
+    config.getfloat("BACKUP", "INTERVAL", fallback=copias.INTERVALO),
+    config.getint("BACKUP", "KEEP", fallback=copias.CONSERVAR),
+    config.getfloat("BACKUP", "SNAPSHOT_INTERVAL", fallback=copias.INTERVALO_COMPACTA),
+    config.getint("BACKUP", "PAGES", fallback=db.PAGINAS_COPIA),
+    config.getfloat("BACKUP", "PAUSE", fallback=db.PAUSA_COPIA))
 
 # All needed collections are defined here
 usuarios = database.get_all_usuarios()
-cabeceras = config["DATA"]["DATA_HEADERS"].split()
+cabeceras = [cabecera.strip() for cabecera in config["DATA"]["DATA_HEADERS"].split(",")]
+tam_lote_importacion = config.getint("DATA", "IMPORT_BATCH_SIZE", fallback=None)
+marcar_fase("Base de datos")
 
 
 ################################################################################
@@ -362,6 +510,9 @@ ventana_principal.resizable(False, False)
 ventana_principal.iconbitmap("imgs/favicon.ico")
 ventana_principal.configure(background="#FFFFFF")
 
+# Auxiliary windows, built the first time they are opened and reused afterwards
+ventanas = tk_utils.GestorVentanas(ventana_principal)
+
 # Add a style
 STYLE_THEME = config["STYLES"]["THEME"]
 style = ttk.Style(ventana_principal)
@@ -381,8 +532,11 @@ ventana_principal.config(menu=menu)
 # Add a file menu with commands to load and extract excel files
 file_menu = tk.Menu(menu, tearoff=False)
 menu.add_cascade(label="Archivo", menu=file_menu)
+file_menu.add_command(label="Ver registros",
+    command=lambda: navegador.NavegadorRegistros(ventana_principal, database, cabeceras))
 file_menu.add_command(label="Exportar informe", command=exportar_aux)
 file_menu.add_command(label="Importar datos", command=importar)
+file_menu.add_command(label="Copia de seguridad", command=copia_seguridad)
 file_menu.add_command(label="Salir", command=ventana_principal.quit)
 # Add a help menu
 help_menu = tk.Menu(menu, tearoff=False)
@@ -394,7 +548,7 @@ help_menu.add_command(label="Acerca de...", command=about)
 ################################################################################
 # Add a label
 marco_titulo = ttk.Frame(ventana_principal, style="TFrame")
-logo_img = ImageTk.PhotoImage(Image.open("./imgs/logo.JPG").resize((80, 100)))
+logo_img = tk_utils.cargar_imagen(os.path.join(os.path.dirname(__file__), "imgs", "logo.JPG"), (80, 100))
 logo_label = ttk.Label(
     marco_titulo,
     image=logo_img,
@@ -428,6 +582,14 @@ operador_cb = ttk.Combobox(factores_principales, textvariable=operador, state="r
 operador_cb["values"] = [(f"{u[1]} - {u[2]}") for u in usuarios]
 operador_cb.grid(column=1, row=0, columnspan=2, pady=(5, 15), padx=(15, 15))
 
+# Add a field to search the registers by any of their words
+ttk.Label(factores_principales, text="Buscar:", font=("Gotham", 14))\
+    .grid(column=3, row=0, sticky=tk.E, pady=(5, 15), padx=(15, 0))
+busqueda = tk.StringVar()
+busqueda_entry = ttk.Entry(factores_principales, textvariable=busqueda, font=("Gotham", 12), width=25)
+busqueda_entry.grid(column=4, row=0, pady=(5, 15), padx=(15, 15))
+busqueda_entry.bind("<Return>", buscar_texto)
+
 
 ################################################################################
 # Add a frame for the entry fields
@@ -564,12 +726,35 @@ confirmar = ttk.Button(botones, text="Confirmar", command=submit)\
 limpiar = ttk.Button(botones, text="Limpiar", command=clear)\
     .grid(column=2, row=0, pady=(10, 20), padx=(15, 0))
 
+# Add a status bar with the state of the background jobs
+estado_tareas = tk.StringVar()
+ttk.Label(ventana_principal, textvariable=estado_tareas, font=("Gotham Light", 10))\
+    .grid(column=0, row=4, columnspan=4, sticky=tk.W, pady=(0, 5))
+gestor_tareas = tareas.GestorTareas(ventana_principal, al_cambiar_estado=estado_tareas.set)
+
 clear()
 
 
 ################################################################################
 # Center the window in the screen
 tk_utils.centrar_ventana(ventana_principal)
+marcar_fase("Ventana")
+
+# Report the start-up time once the first frame is drawn, if asked with --tiempos
+if "--tiempos" in sys.argv:
+    ventana_principal.after_idle(informe_arranque)
 
 # Start GUI
-ventana_principal.mainloop()
\ No newline at end of file
+ventana_principal.mainloop()
+
+# Stop the background jobs and backups, write the pending audit events and close
+# the database connections once the window is closed
+gestor_tareas.cerrar()
+copias_seguridad.cerrar()
+registro_auditoria.cerrar()
+database.close()
+
+# Log the statements that took the most time during the session
+for sentencia, datos in list(database.get_estadisticas()["sentencias"].items())[:10]:
+    logging.getLogger("db").info("%d llamadas, %.3f s, %d filas: %s", datos["llamadas"],
+                                 datos["segundos"], datos["filas"], sentencia)
@@ -0,0 +1,198 @@
+'''Register browser
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the windows used to browse and search the
+    registers. They are read page by page with keyset pagination while the user
+    scrolls, and only a few pages are kept in the table at the same time, so
+    browsing a million registers is as fast and takes as much memory as browsing
+    a hundred. Searches use the full-text index of the database.
+Date: 2023-06-30
+'''
+
+import time
+import tkinter as tk
+from tkinter import ttk
+from collections import deque
+import db
+import tk_utils
+
+# Number of pages kept in the table at the same time
+PAGINAS = 5
+
+# Fraction of the table, from each of its edges, at which a new page is loaded
+MARGEN = 0.2
+
+
+def crear_tabla(ventana, cabeceras, ordenar=None):
+    '''Fill a window with a table of registers, its scrollbar and a status label.
+        If given, ordenar is called with the column whose header is clicked, for
+        the indexed columns. Returns the table, the scrollbar and the status variable
+    '''
+    ventana.iconbitmap("imgs/favicon.ico")
+    ventana.configure(background="#FFFFFF")
+
+    # Create the table
+    columnas = db.CAMPOS_REGISTROS[:len(cabeceras)]
+    tabla = ttk.Treeview(ventana, columns=columnas, show="headings", height=25, selectmode="browse")
+    for columna, cabecera in zip(columnas, cabeceras):
+        if ordenar is not None and columna in db.ORDENES:
+            tabla.heading(columna, text=cabecera, command=lambda columna=columna: ordenar(columna))
+        else:
+            tabla.heading(columna, text=cabecera)
+        tabla.column(columna, width=110, anchor=tk.CENTER)
+    tabla.grid(column=0, row=0, sticky="NSEW")
+
+    # Create a scrollbar
+    barra = ttk.Scrollbar(ventana, orient=tk.VERTICAL, command=tabla.yview)
+    barra.grid(column=1, row=0, sticky="NS")
+    tabla.configure(yscrollcommand=barra.set)
+
+    # Create a label for the number of registers
+    estado = tk.StringVar()
+    ttk.Label(ventana, textvariable=estado, font=("Gotham Light", 10))\
+        .grid(column=0, row=1, columnspan=2, sticky=tk.W)
+
+    ventana.grid_columnconfigure(0, weight=1)
+    ventana.grid_rowconfigure(0, weight=1)
+    return tabla, barra, estado
+
+def valores(fila):
+    '''Values of a register shown in a table'''
+    return ["" if valor is None else valor for valor in fila]
+
+
+class NavegadorRegistros:
+    '''Window with a table of the registers that loads the next or previous page
+        when the user scrolls close to one of its edges, and drops the page at
+        the other edge when there are too many
+    '''
+    def __init__(self, padre, database, cabeceras, tam_pagina=db.TAM_PAGINA, paginas=PAGINAS):
+        '''Constructor'''
+        self.database = database
+        self.tam_pagina = tam_pagina
+        self.max_paginas = paginas
+        self.orden = "id"
+        self.paginas = deque()
+        self.hay_anteriores = False
+        self.hay_siguientes = False
+        self._pendiente = None
+
+        # Create a new window with a table sortable by the indexed columns
+        self.ventana = tk.Toplevel(padre)
+        self.ventana.title("Registros")
+        self.tabla, self.barra, self.estado = crear_tabla(self.ventana, cabeceras, self.ordenar)
+        self.tabla.configure(yscrollcommand=self._al_desplazar)
+
+        self.ordenar("id")
+        tk_utils.centrar_ventana(self.ventana)
+
+    def ordenar(self, orden):
+        '''Sort the table by a column and show its first page'''
+        self.orden = orden
+        self.tabla.delete(*self.tabla.get_children())
+        self.paginas.clear()
+        filas = self.database.get_pagina_registros(orden, limite=self.tam_pagina)
+        self.hay_anteriores = False
+        self.hay_siguientes = len(filas) == self.tam_pagina
+        self._cargar(filas, al_final=True)
+        self.tabla.yview_moveto(0)
+        self.estado.set(f"{self.database.count_registros()} registros, ordenados por {orden}")
+
+    def _al_desplazar(self, primero, ultimo):
+        '''Move the scrollbar and, close to an edge of the table, load another page'''
+        self.barra.set(primero, ultimo)
+        if self._pendiente is not None:
+            return
+        if float(ultimo) > 1 - MARGEN and self.hay_siguientes:
+            self._pendiente = self.ventana.after_idle(self._siguiente)
+        elif float(primero) < MARGEN and self.hay_anteriores:
+            self._pendiente = self.ventana.after_idle(self._anterior)
+
+    def _siguiente(self):
+        '''Load the page after the last one of the table'''
+        self._pendiente = None
+        filas = self.database.get_pagina_registros(self.orden, despues=self.paginas[-1]["fin"],
+                                                   limite=self.tam_pagina)
+        self.hay_siguientes = len(filas) == self.tam_pagina
+        self._cargar(filas, al_final=True)
+        if len(self.paginas) > self.max_paginas:
+            self._descartar(al_final=False)
+
+    def _anterior(self):
+        '''Load the page before the first one of the table'''
+        self._pendiente = None
+        filas = self.database.get_pagina_registros(self.orden, antes=self.paginas[0]["inicio"],
+                                                   limite=self.tam_pagina)
+        self.hay_anteriores = len(filas) == self.tam_pagina
+        self._cargar(filas, al_final=False)
+        if len(self.paginas) > self.max_paginas:
+            self._descartar(al_final=True)
+
+    def _cargar(self, filas, al_final):
+        '''Add a page of rows at one of the edges of the table. Every row ends with
+            the value of the sort column, which together with the id is its key
+        '''
+        if not filas:
+            return
+        if al_final:
+            items = [self.tabla.insert("", tk.END, values=self._valores(fila)) for fila in filas]
+        else:
+            arriba = self._fila_superior()
+            items = [self.tabla.insert("", 0, values=self._valores(fila)) for fila in reversed(filas)]
+            items.reverse()
+            self._mover_a(arriba + len(items))
+        pagina = {
+            "items": items,
+            "inicio": (filas[0][-1], filas[0][0]),
+            "fin": (filas[-1][-1], filas[-1][0]),
+        }
+        if al_final:
+            self.paginas.append(pagina)
+        else:
+            self.paginas.appendleft(pagina)
+
+    def _descartar(self, al_final):
+        '''Remove the page at one of the edges of the table'''
+        if al_final:
+            pagina = self.paginas.pop()
+            self.hay_siguientes = True
+            self.tabla.delete(*pagina["items"])
+        else:
+            pagina = self.paginas.popleft()
+            self.hay_anteriores = True
+            arriba = self._fila_superior()
+            self.tabla.delete(*pagina["items"])
+            self._mover_a(arriba - len(pagina["items"]))
+
+    def _fila_superior(self):
+        '''Position of the row shown at the top of the table'''
+        return float(self.tabla.yview()[0]) * len(self.tabla.get_children())
+
+    def _mover_a(self, fila):
+        '''Scroll the table so the row at a position is shown at the top, keeping
+            the same rows in view after adding or removing rows above them
+        '''
+        self.tabla.yview_moveto(max(fila, 0) / max(len(self.tabla.get_children()), 1))
+
+    def _valores(self, fila):
+        '''Values of a row shown in the table, without its sort key'''
+        return valores(fila[:-1])
+
+
+class ResultadosBusqueda:
+    '''Window with the registers found by a full-text search, sorted by relevance'''
+    def __init__(self, padre, database, cabeceras, texto, limite=db.TAM_PAGINA):
+        '''Constructor'''
+        self.ventana = tk.Toplevel(padre)
+        self.ventana.title(f"Búsqueda: {texto}")
+        self.tabla, self.barra, self.estado = crear_tabla(self.ventana, cabeceras)
+
+        # Search the registers and fill the table
+        inicio = time.perf_counter()
+        filas = database.search_registros(texto, limite)
+        milisegundos = (time.perf_counter() - inicio) * 1000
+        for fila in filas:
+            self.tabla.insert("", tk.END, values=valores(fila))
+        self.estado.set(f"{len(filas)} resultados en {milisegundos:.0f} ms"
+                        + (f" (se muestran los {limite} más relevantes)" if len(filas) == limite else ""))
+        tk_utils.centrar_ventana(self.ventana)
@@ -0,0 +1,132 @@
+'''Background jobs
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the classes used to run long jobs, such as exports
+    and imports, outside of the Tkinter main loop. Jobs run on a thread pool and
+    the main loop polls them with after(), so every callback that touches the GUI
+    runs on the Tkinter thread and the form stays usable meanwhile.
+Date: 2023-06-30
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of jobs that can run at the same time
+TRABAJADORES = 2
+
+# Milliseconds between two checks of the running jobs
+INTERVALO = 100
+
+
+class TareaCancelada(Exception):
+    '''Exception raised inside a job when the user cancels it'''
+
+
+class Tarea:
+    '''A job running in the background. The job function receives the method
+        informar as its progreso argument: it stores the progress and raises
+        TareaCancelada if the job has been cancelled
+    '''
+    def __init__(self, nombre):
+        '''Constructor'''
+        self.nombre = nombre
+        self.hecho = 0
+        self.total = None
+        self.futuro = None
+        self._cancelada = threading.Event()
+
+    def informar(self, hecho, total=None):
+        '''Store the progress of the job. Called from the worker thread'''
+        self.hecho = hecho
+        self.total = total
+        if self._cancelada.is_set():
+            raise TareaCancelada(self.nombre)
+
+    def cancelar(self):
+        '''Ask the job to stop at its next progress report'''
+        self._cancelada.set()
+
+    def cancelada(self):
+        '''Whether the job has been asked to stop'''
+        return self._cancelada.is_set()
+
+    def terminada(self):
+        '''Whether the job has finished, successfully or not'''
+        return self.futuro is not None and self.futuro.done()
+
+    def porcentaje(self):
+        '''Percentage of the job done, or None if its size is unknown'''
+        if not self.total:
+            return None
+        return min(100, 100 * self.hecho // self.total)
+
+    def estado(self):
+        '''Text describing the state of the job'''
+        porcentaje = self.porcentaje()
+        if porcentaje is None:
+            return f"{self.nombre}: {self.hecho} filas"
+        return f"{self.nombre}: {porcentaje}%"
+
+
+class GestorTareas:
+    '''Runs jobs on a thread pool and delivers their results to the Tkinter thread
+        by polling them with after()
+    '''
+    def __init__(self, ventana, trabajadores=TRABAJADORES, al_cambiar_estado=None):
+        '''Constructor. al_cambiar_estado receives a text with the state of the
+            running jobs every time they are checked
+        '''
+        self.ventana = ventana
+        self.al_cambiar_estado = al_cambiar_estado
+        self.ejecutor = ThreadPoolExecutor(max_workers=trabajadores)
+        self.tareas = []
+        self._sondeo = None
+
+    def lanzar(self, nombre, funcion, *args, al_terminar=None, al_fallar=None,
+               al_cancelar=None, **kwargs):
+        '''Run funcion(*args, progreso=tarea.informar, **kwargs) in the background.
+            When it ends, al_terminar receives its result, al_fallar the exception it
+            raised, or al_cancelar is called if the user cancelled it
+        '''
+        tarea = Tarea(nombre)
+        tarea.futuro = self.ejecutor.submit(funcion, *args, progreso=tarea.informar, **kwargs)
+        self.tareas.append((tarea, al_terminar, al_fallar, al_cancelar))
+        if self._sondeo is None:
+            self._sondeo = self.ventana.after(INTERVALO, self._sondear)
+        return tarea
+
+    def estado(self):
+        '''Text with the state of every running job'''
+        return " | ".join(tarea.estado() for tarea, *_ in self.tareas)
+
+    def _sondear(self):
+        '''Check the running jobs and run the callbacks of the finished ones'''
+        self._sondeo = None
+        pendientes = []
+        terminadas = []
+        for entrada in self.tareas:
+            (terminadas if entrada[0].terminada() else pendientes).append(entrada)
+        self.tareas = pendientes
+        if self.al_cambiar_estado is not None:
+            self.al_cambiar_estado(self.estado())
+        for tarea, al_terminar, al_fallar, al_cancelar in terminadas:
+            error = tarea.futuro.exception()
+            if isinstance(error, TareaCancelada):
+                if al_cancelar is not None:
+                    al_cancelar()
+            elif error is not None:
+                if al_fallar is not None:
+                    al_fallar(error)
+            elif al_terminar is not None:
+                al_terminar(tarea.futuro.result())
+        if self.tareas:
+            self._sondeo = self.ventana.after(INTERVALO, self._sondear)
+
+    def cerrar(self):
+        '''Cancel the running jobs and wait for them to stop'''
+        if self._sondeo is not None:
+            self.ventana.after_cancel(self._sondeo)
+            self._sondeo = None
+        for tarea, *_ in self.tareas:
+            tarea.cancelar()
+        self.ejecutor.shutdown(wait=True)
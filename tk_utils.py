@@ -2,9 +2,17 @@
 
 This module contains a collection of Tkinter utilities, including:
     - CreateToolTip: Creates a tooltip for a given widget
+    - DialogoProgreso: Shows the progress of a background job and lets the user cancel it
+    - GestorVentanas: Builds each auxiliary window once and then hides and shows it
+    - cargar_imagen: Loads a resized image, cached on disk after the first time
 '''
 
+import os
 import tkinter as tk
+from tkinter import ttk
+
+# Folder where the resized images are cached, next to the application
+CACHE_IMAGENES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "imgs", ".cache")
 
 class CreateToolTip(object):
     """Create a tooltip for a given widget"""
@@ -57,6 +65,83 @@ class CreateToolTip(object):
         if tw:
             tw.destroy()
 
+class DialogoProgreso:
+    """ Ventana con el progreso de una tarea en segundo plano y un botón para
+        cancelarla. No bloquea la ventana principal y se cierra sola al terminar
+        la tarea """
+    def __init__(self, padre, tarea, intervalo=100):
+        self.tarea = tarea
+        self.intervalo = intervalo
+        self.ventana = tk.Toplevel(padre)
+        self.ventana.title(tarea.nombre)
+        self.ventana.resizable(False, False)
+        # Cerrar el diálogo solo lo oculta: la tarea sigue en segundo plano
+        self.ventana.protocol("WM_DELETE_WINDOW", self.ventana.withdraw)
+
+        self.texto = tk.StringVar(value=tarea.estado())
+        ttk.Label(self.ventana, textvariable=self.texto)\
+            .grid(row=0, column=0, padx=10, pady=(10, 5))
+        self.barra = ttk.Progressbar(self.ventana, length=300, mode="indeterminate", maximum=100)
+        self.barra.grid(row=1, column=0, padx=10, pady=5)
+        self.boton = ttk.Button(self.ventana, text="Cancelar", command=self.cancelar)
+        self.boton.grid(row=2, column=0, padx=10, pady=(5, 10))
+
+        centrar_ventana(self.ventana)
+        self.barra.start()
+        self.actualizar()
+
+    def actualizar(self):
+        """ Refleja el progreso de la tarea hasta que termina """
+        if self.tarea.terminada():
+            self.barra.stop()
+            self.ventana.destroy()
+            return
+        porcentaje = self.tarea.porcentaje()
+        if porcentaje is not None:
+            if str(self.barra["mode"]) != "determinate":
+                self.barra.stop()
+                self.barra.configure(mode="determinate")
+            self.barra["value"] = porcentaje
+        self.texto.set("Cancelando..." if self.tarea.cancelada() else self.tarea.estado())
+        self.ventana.after(self.intervalo, self.actualizar)
+
+    def cancelar(self):
+        """ Pide a la tarea que se detenga """
+        self.tarea.cancelar()
+        self.boton.configure(state="disabled")
+
+class GestorVentanas:
+    """ Ventanas auxiliares que se construyen la primera vez que se abren y
+        después solo se ocultan con withdraw y se vuelven a mostrar con
+        deiconify, sin reconstruir sus widgets. Cerrarlas solo las oculta """
+    def __init__(self, padre):
+        self.padre = padre
+        self.ventanas = {}
+
+    def mostrar(self, clave, construir):
+        """ Muestra la ventana clave. La primera vez crea una Toplevel vacía y
+            construir(ventana) le añade los widgets; puede devolver una función
+            que deja la ventana en su estado inicial, a la que se llama cada vez
+            que se vuelve a abrir """
+        if clave in self.ventanas and self.ventanas[clave][0].winfo_exists():
+            ventana, reiniciar = self.ventanas[clave]
+            if reiniciar is not None:
+                reiniciar()
+            ventana.deiconify()
+        else:
+            ventana = tk.Toplevel(self.padre)
+            ventana.protocol("WM_DELETE_WINDOW", ventana.withdraw)
+            self.ventanas[clave] = (ventana, construir(ventana))
+            centrar_ventana(ventana)
+        ventana.lift()
+        ventana.focus_set()
+        return ventana
+
+    def ocultar(self, clave):
+        """ Oculta la ventana clave, si se ha abierto alguna vez """
+        if clave in self.ventanas:
+            self.ventanas[clave][0].withdraw()
+
 def redimensionar_filas_columnas(frame):
     """ Redimensiona las filas y columnas de un frame """
     col_count, row_count = frame.grid_size()
@@ -75,4 +160,21 @@ def centrar_ventana(ventana):
     size = tuple(int(_) for _ in ventana.geometry().split('+')[0].split('x'))
     x = w/2 - size[0]/2
     y = h/2 - size[1]/2
-    ventana.geometry("%dx%d+%d+%d" % (size + (x, y)))
\ No newline at end of file
+    ventana.geometry("%dx%d+%d+%d" % (size + (x, y)))
+
+def cargar_imagen(ruta, tamano, cache=CACHE_IMAGENES):
+    """ Carga una imagen redimensionada a tamano (ancho, alto). La primera vez se
+        redimensiona con PIL y se guarda como PNG en la carpeta cache; después se
+        carga directamente con Tkinter, sin importar PIL. Si la caché no se puede
+        escribir, la imagen se redimensiona en memoria cada vez """
+    nombre = os.path.splitext(os.path.basename(ruta))[0]
+    cacheada = os.path.join(cache, f"{nombre}_{tamano[0]}x{tamano[1]}.png")
+    try:
+        if not os.path.exists(cacheada) or os.path.getmtime(cacheada) < os.path.getmtime(ruta):
+            from PIL import Image
+            os.makedirs(cache, exist_ok=True)
+            Image.open(ruta).resize(tamano).save(cacheada)
+        return tk.PhotoImage(file=cacheada)
+    except OSError:
+        from PIL import Image, ImageTk
+        return ImageTk.PhotoImage(Image.open(ruta).resize(tamano))
@@ -0,0 +1,165 @@
+'''Validation of the registers to import
+
+Author: Alejandro Sanchez Rodriguez
+Description: This file contains the validation engine used before importing
+    registers. Instead of checking the rows one by one, every column of a batch is
+    checked at once with NumPy arrays, and the result is a report with every
+    failing row and column. It doesn't depend on Tkinter, so it can be used from
+    any front end.
+Date: 2023-06-30
+'''
+
+from collections import namedtuple
+from datetime import date, datetime
+import numpy as np
+
+# Columns of an imported register
+COLUMNAS = ["fechaEntrada", "operador", "identificador", "importe", "estado", "x",
+            "num_llamadas", "fechaResolucion", "operadorResolucion", "observaciones"]
+
+# Format of the dates: dd-MM-yyyy
+FORMATO_FECHA = "%d-%m-%Y"
+POSICIONES_DIGITOS = [0, 1, 3, 4, 6, 7, 8, 9]
+POSICIONES_GUIONES = [2, 5]
+
+ErrorValidacion = namedtuple("ErrorValidacion", ["fila", "columna", "mensaje"])
+
+
+class InformeValidacion:
+    '''Report with every error found while validating a set of registers'''
+    def __init__(self):
+        self.errores = []
+        self.filas = 0
+
+    def __bool__(self):
+        '''A report is truthy when there are no errors'''
+        return not self.errores
+
+    @property
+    def filas_erroneas(self):
+        '''Sorted list of the rows with at least one error'''
+        return sorted({error.fila for error in self.errores})
+
+    def agregar(self, filas, columna, mensaje):
+        '''Add the same error for several rows'''
+        self.errores.extend(ErrorValidacion(int(fila), columna, mensaje) for fila in filas)
+
+    def extender(self, informe):
+        '''Add the errors of another report'''
+        self.errores.extend(informe.errores)
+        self.filas += informe.filas
+
+    def resumen(self, limite=10):
+        '''Text summary of the report, showing at most limite errors'''
+        if not self.errores:
+            return f"{self.filas} filas correctas"
+        errores = sorted(self.errores, key=lambda e: (e.fila, COLUMNAS.index(e.columna)))
+        lineas = [f"{len(self.filas_erroneas)} de {self.filas} filas con errores:"]
+        lineas += [f"  Fila {e.fila}, {e.columna}: {e.mensaje}" for e in errores[:limite]]
+        if len(errores) > limite:
+            lineas.append(f"  ... y {len(errores) - limite} errores más")
+        return "\n".join(lineas)
+
+
+def validar_registros(registros, primera_fila=2):
+    '''Validate a batch of registers column by column and return a report with
+        every error. primera_fila is the row of the file of the first register
+    '''
+    informe = InformeValidacion()
+    informe.filas = len(registros)
+    if not registros:
+        return informe
+
+    filas = np.arange(primera_fila, primera_fila + len(registros))
+    columnas = _columnas(registros)
+
+    # fecha entrada, operador and identificador are always required
+    _agregar(informe, filas, ~_fechas_validas(columnas[0]), 0, "Fecha incorrecta")
+    _agregar(informe, filas, _vacios(columnas[1]), 1, "Campo vacío")
+    _agregar(informe, filas, _vacios(columnas[2]), 2, "Campo vacío")
+
+    # importe must be a number, and num_llamadas too whenever it's given
+    _agregar(informe, filas, ~_numeros_validos(columnas[3], float), 3, "Importe incorrecto")
+    incidencias = columnas[4] == "INCIDENCIA"
+    _agregar(informe, filas, (incidencias | ~_vacios(columnas[6])) & ~_numeros_validos(columnas[6], int),
+             6, "Número de llamadas incorrecto")
+
+    # If estado is INCIDENCIA, the rest of the fields are required too
+    if incidencias.any():
+        for columna in (5, 8, 9):
+            _agregar(informe, filas, incidencias & _vacios(columnas[columna]), columna,
+                     "Campo vacío")
+        _agregar(informe, filas, incidencias & ~_fechas_validas(columnas[7]), 7,
+                 "Fecha incorrecta")
+    return informe
+
+def _agregar(informe, filas, errores, columna, mensaje):
+    '''Add an error for every row marked in the errores mask'''
+    if errores.any():
+        informe.agregar(filas[errores], COLUMNAS[columna], mensaje)
+
+def _columnas(registros):
+    '''Transpose the registers into one text array per column. Dates read from
+        Excel as datetime values are written with the date format
+    '''
+    columnas = []
+    for columna in zip(*(_completar(registro) for registro in registros)):
+        if any(isinstance(valor, date) for valor in columna):
+            columna = [valor.strftime(FORMATO_FECHA) if isinstance(valor, (date, datetime))
+                       else valor for valor in columna]
+        columnas.append(np.array(["" if valor is None else str(valor) for valor in columna]))
+    return columnas
+
+def _completar(registro):
+    '''Pad or cut a register to the expected number of columns'''
+    registro = list(registro[:len(COLUMNAS)])
+    return registro + [""] * (len(COLUMNAS) - len(registro))
+
+def _vacios(columna):
+    '''Mask of the empty values of a column'''
+    return np.char.str_len(np.char.strip(columna)) == 0
+
+def _numeros_validos(columna, tipo):
+    '''Mask of the values of a column that can be converted to tipo. The whole
+        column is converted at once, and only if that fails is it checked value by value
+    '''
+    try:
+        valores = columna.astype(float)
+        validos = np.ones(len(columna), dtype=bool)
+    except ValueError:
+        valores = np.full(len(columna), np.nan)
+        validos = np.zeros(len(columna), dtype=bool)
+        for i, valor in enumerate(columna):
+            try:
+                valores[i] = float(valor)
+                validos[i] = True
+            except ValueError:
+                pass
+    validos &= np.isfinite(valores)
+    if tipo is int:
+        validos &= np.mod(np.where(validos, valores, 0), 1) == 0
+    return validos
+
+def _fechas_validas(columna):
+    '''Mask of the values of a column that are real dates in the dd-MM-yyyy format.
+        The format is checked on a matrix of characters and the day against the
+        length of each month, all with array operations
+    '''
+    validos = np.char.str_len(columna) == 10
+    caracteres = columna.astype("U10").view("U1").reshape(len(columna), 10)
+    validos &= np.char.isdigit(caracteres[:, POSICIONES_DIGITOS]).all(axis=1)
+    validos &= (caracteres[:, POSICIONES_GUIONES] == "-").all(axis=1)
+
+    # Only the rows with a valid format are parsed
+    digitos = np.where(validos[:, None], caracteres[:, POSICIONES_DIGITOS], "0")
+    digitos = digitos.astype(np.int64)
+    dia = digitos[:, 0] * 10 + digitos[:, 1]
+    mes = digitos[:, 2] * 10 + digitos[:, 3]
+    anio = digitos[:, 4] * 1000 + digitos[:, 5] * 100 + digitos[:, 6] * 10 + digitos[:, 7]
+    validos &= (mes >= 1) & (mes <= 12) & (dia >= 1)
+
+    # Days of each month, as the distance to the first day of the next month
+    meses = ((anio - 1970) * 12 + np.clip(mes, 1, 12) - 1).astype("datetime64[M]")
+    dias_mes = ((meses + 1).astype("datetime64[D]") - meses.astype("datetime64[D]")).astype(np.int64)
+    validos &= dia <= dias_mes
+    return validos